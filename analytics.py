@@ -0,0 +1,204 @@
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from snapshot import RollSnapshot
+
+SIDES = 12
+# users with fewer rolls than this are left out of the per-user fairness tests
+MIN_USER_ROLLS = 30
+
+
+def roll_histogram(rolls: np.ndarray) -> np.ndarray:
+    """
+    Counts how many times each value was rolled
+
+    Args:
+        rolls (np.ndarray): Roll values (1-12)
+
+    Returns:
+        np.ndarray: Counts for 1 to 12
+    """
+    return np.bincount(rolls.astype(np.int64), minlength=SIDES + 1)[1 : SIDES + 1]
+
+
+def user_histograms(user_ids: np.ndarray, rolls: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts how many times each user rolled each value
+
+    Args:
+        user_ids (np.ndarray): Discord User ID of each roll
+        rolls (np.ndarray): Roll values (1-12)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The distinct user IDs and a (users, 12) array of counts
+    """
+    users, index = np.unique(user_ids, return_inverse=True)
+    counts = np.bincount(
+        index * SIDES + (rolls.astype(np.int64) - 1), minlength=len(users) * SIDES
+    )
+    return users, counts.reshape(len(users), SIDES)
+
+
+def chi_square_uniform(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pearson's chi-square test of each row of counts against a fair die
+
+    Args:
+        counts (np.ndarray): Counts for 1 to 12, either one row or a (rows, 12) array
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Chi-square statistic and p-value of each row
+    """
+    counts = np.atleast_2d(counts).astype(np.float64)
+    expected = counts.sum(axis=1, keepdims=True) / SIDES
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistic = np.where(expected > 0, (counts - expected) ** 2 / expected, 0).sum(axis=1)
+    p_values = np.array([chi2_sf(x, SIDES - 1) for x in statistic])
+    return statistic, p_values
+
+
+def chi2_sf(x: float, dof: int) -> float:
+    """
+    Survival function of the chi-square distribution, the chance of a statistic at least this large from a fair die
+
+    Args:
+        x (float): The chi-square statistic
+        dof (int): Degrees of freedom
+
+    Returns:
+        float: The p-value
+    """
+    if x <= 0:
+        return 1.0
+    return _gammaincc(dof / 2, x / 2)
+
+
+def _gammaincc(a: float, x: float) -> float:
+    # regularised upper incomplete gamma function, series below a + 1 and continued fraction above
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1 / a
+        n = a
+        for _ in range(500):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1 - total * math.exp(log_prefix))
+
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 500):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+
+def monthly_trend(timestamps: np.ndarray, rolls: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Works out the number of rolls and the average roll for each month
+
+    Args:
+        timestamps (np.ndarray): Microseconds since the epoch of each roll
+        rolls (np.ndarray): Roll values (1-12)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The months, the number of rolls and the mean roll of each month
+    """
+    months, index = np.unique(
+        timestamps.astype("datetime64[us]").astype("datetime64[M]"), return_inverse=True
+    )
+    counts = np.bincount(index, minlength=len(months))
+    sums = np.bincount(index, weights=rolls.astype(np.float64), minlength=len(months))
+    return months, counts, sums / np.maximum(counts, 1)
+
+
+def fairness_report(
+    snapshot: RollSnapshot,
+    user_id: Optional[int] = None,
+    months: int = 6,
+    usernames: Optional[Dict[int, str]] = None,
+) -> str:
+    """
+    Builds a text report on whether the pit is rigged from the roll snapshot. Removed rolls are left out
+
+    Args:
+        snapshot (RollSnapshot): The roll history
+        user_id (int, optional): Only report on this Discord User ID
+        months (int): Number of recent months to show in the trend
+        usernames (Dict[int, str], optional): Names to show for each Discord User ID
+
+    Returns:
+        str: The report
+    """
+    usernames = usernames or {}
+    keep = snapshot.removed == 0
+    if user_id is not None:
+        keep &= snapshot.user_id == user_id
+    rolls = snapshot.roll[keep]
+    if not len(rolls):
+        return "No rolls to look at"
+
+    lines = []
+    counts = roll_histogram(rolls)
+    statistic, p_value = chi_square_uniform(counts)
+    lines.append(f"Rolls: {len(rolls)}   mean: {rolls.mean():.2f} (fair is 6.50)")
+    lines.append("Roll  Count      %")
+    for value, count in enumerate(counts, start=1):
+        lines.append(f"{value:>4}  {count:>5}  {100 * count / len(rolls):5.1f}")
+    lines.append(f"Chi-square: {statistic[0]:.2f}, p = {p_value[0]:.4f} ({verdict(p_value[0])})")
+
+    if user_id is None:
+        users, user_counts = user_histograms(snapshot.user_id[keep], rolls)
+        active = user_counts.sum(axis=1) >= MIN_USER_ROLLS
+        if active.any():
+            _, user_p_values = chi_square_uniform(user_counts[active])
+            order = np.argsort(user_p_values)[:5]
+            lines.append("")
+            lines.append(f"Least fair users ({MIN_USER_ROLLS}+ rolls):")
+            for index in order:
+                user_rolls = user_counts[active][index]
+                mean = (user_rolls * np.arange(1, SIDES + 1)).sum() / user_rolls.sum()
+                name = usernames.get(int(users[active][index]), users[active][index])
+                lines.append(
+                    f"{name}: {user_rolls.sum()} rolls, mean {mean:.2f}, p = {user_p_values[index]:.4f}"
+                )
+
+    trend_months, trend_counts, trend_means = monthly_trend(snapshot.timestamp[keep], rolls)
+    lines.append("")
+    lines.append("Month    Rolls  Mean")
+    for month, count, mean in list(zip(trend_months, trend_counts, trend_means))[-months:]:
+        lines.append(f"{str(month)}  {count:>5}  {mean:.2f}")
+    return "\n".join(lines)
+
+
+def verdict(p_value: float) -> str:
+    """
+    Turns a p-value into something the pit can understand
+
+    Args:
+        p_value (float): p-value of a chi-square test
+
+    Returns:
+        str: The verdict
+    """
+    if p_value < 0.001:
+        return "rigged"
+    if p_value < 0.05:
+        return "sus"
+    return "fair"
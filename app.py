@@ -1,6 +1,6 @@
 #!/bin/python3
 
-from typing import Optional, Union, NamedTuple
+from typing import Iterable, Optional, Tuple, Union, NamedTuple
 from enum import Enum
 import discord
 from discord import app_commands
@@ -13,14 +13,34 @@ import time
 import random
 import datetime
 import sqlalchemy
-from sqlalchemy import create_engine, extract
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from models import User, Rolls, DoubleRolls, Base
+from models import (
+    User,
+    Rolls,
+    DoubleRolls,
+    Streaks,
+    ArchivedPeriods,
+    VoidBatches,
+    VoidedRolls,
+    Base,
+    archive_table_name,
+    rolls_archive_table,
+    doublerolls_archive_table,
+)
+from streaks import advance_streak, replay_streak, live_day_streak
+from cooldowns import CooldownStore, MemoryCooldownStore, SQLCooldownStore, shared_cooldown
+from permissions import Capability, PermissionIndex, build_capabilities
+from snapshot import RollSnapshot
+from botlogging import setup_logging, interaction_fields
+from analytics import fairness_report
+from transcript import FilterRules, NO_FILTER, build_transcript
+from members import RecentMembers, cache_report, member_cache_policy
+from startup import StartupTimer
 import csv
 
 # from gtts import gTTS
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -32,60 +52,207 @@ sub_role = 600414478747828244
 pit = 1053318611172859926
 # pit=1162651881206726827
 
+permission_index = PermissionIndex(
+    role_capabilities=build_capabilities(
+        [([sub_role], Capability.SUBSCRIBER), (mod_roles, Capability.MOD)]
+    ),
+    user_capabilities=build_capabilities(
+        [(debug_users, Capability.DEBUG), (data_users, Capability.DATA)]
+    ),
+)
 
-# load dotenv
-dotenv.load_dotenv()
 
-# load token
-try:
-    TOKEN = os.environ["TOKEN"]
-except KeyError:
-    logger.error(
-        "No token found! Make sure you have a .env file with a TOKEN variable"
+# filled in by the startup phases, see prepare()
+TOKEN = ""
+DEV = False
+MY_GUILD: Optional[discord.Object] = None
+database_url = ""
+# reports and analytics read from here, defaults to the main database
+read_database_url = ""
+
+# low information messages (emotes, bare links, "lol", spam) are dropped before anything is summarized
+transcript_rules = FilterRules()
+
+# columnar copy of the roll history used for analytics
+snapshot_path = "data/snapshot"
+
+# by default only members who actually use the bot are kept, instead of chunking every member of every guild
+member_cache = member_cache_policy()
+
+# evicting a member from the recent cache drops them from the permission index too, so neither grows forever
+recent_members = RecentMembers(member_cache.recent_size, on_evict=permission_index.forget_member)
+
+cooldown_store: CooldownStore = MemoryCooldownStore()
+
+engine: Optional[sqlalchemy.Engine] = None
+# separate pool (and usually a replica) for reports and analytics, so a big export doesn't hold up pitroll
+read_engine: Optional[sqlalchemy.Engine] = None
+# SQLite tables made before sqlite_autoincrement was set, these reuse IDs if they are ever emptied
+legacy_rowid_tables: set = set()
+# bound to the engine once the database phase has run
+Session = sessionmaker()
+session: sqlalchemy.orm.Session
+
+bot: "MyClient"
+
+startup_timer = StartupTimer()
+
+
+def load_config() -> None:
+    """
+    Startup phase: reads the settings from the environment and .env file, and sets up logging
+    """
+    global TOKEN, DEV, MY_GUILD, database_url, read_database_url, transcript_rules, snapshot_path, member_cache, cooldown_store
+
+    # load dotenv
+    dotenv.load_dotenv()
+
+    # logs are written by a background thread so they never hold up the event loop
+    setup_logging(
+        level=getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        json_logs=os.environ.get("LOG_FORMAT", "text").lower() == "json",
     )
-    exit(1)
 
-# load dev guild id if DEV is true
-try:
-    DEV_CHECK = False
-    DEV_CHECK: bool = os.environ["DEV"].lower() == "true"
-except KeyError:
-    logger.info("Running in Production mode")
+    # load token
+    try:
+        TOKEN = os.environ["TOKEN"]
+    except KeyError:
+        logger.error(
+            "No token found! Make sure you have a .env file with a TOKEN variable"
+        )
+        exit(1)
 
-if DEV_CHECK is True:
+    # load dev guild id if DEV is true
     try:
-        DEV = True
-        MY_GUILD = discord.Object(id=int(os.environ["MY_GUILD"]))
+        DEV_CHECK = False
+        DEV_CHECK: bool = os.environ["DEV"].lower() == "true"
+    except KeyError:
+        logger.info("Running in Production mode")
 
+    if DEV_CHECK is True:
+        try:
+            DEV = True
+            MY_GUILD = discord.Object(id=int(os.environ["MY_GUILD"]))
+
+        except KeyError:
+            logger.info(
+                "You are running in dev mode with no dev guild set, the fuck is wrong with you cunt?!"
+            )
+            exit(69)
+    else:
+        DEV = False
+
+    # load database url
+    try:
+        database_url = os.environ["DATABASEURL"]
     except KeyError:
-        logger.info(
-            "You are running in dev mode with no dev guild set, the fuck is wrong with you cunt?!"
-        )
-        exit(69)
-else:
-    DEV = False
-
-# load database url
-try:
-    database_url = os.environ["DATABASEURL"]
-except KeyError:
-    logger.error(
-        "No database url found! Make sure you have a .env file with a DATABASEURL variable"
+        logger.error(
+            "No database url found! Make sure you have a .env file with a DATABASEURL variable"
+        )
+        exit(1)
+
+    # database_url="sqlite+pysqlite:///:memory:"
+
+    read_database_url = os.environ.get("READ_DATABASEURL") or database_url
+
+    transcript_rules = (
+        FilterRules(dedupe_window=int(os.environ.get("TRANSCRIPT_DEDUPE_WINDOW", 50)))
+        if os.environ.get("TRANSCRIPT_FILTER", "true").lower() == "true"
+        else NO_FILTER
     )
-    exit(1)
 
-# database_url="sqlite+pysqlite:///:memory:"
+    snapshot_path = os.environ.get("SNAPSHOT_PATH", snapshot_path)
+
+    try:
+        chunk_override = os.environ.get("CHUNK_GUILDS_AT_STARTUP")
+        member_cache = member_cache_policy(
+            os.environ.get("MEMBER_CACHE", "recent"),
+            recent_size=int(os.environ.get("MEMBER_CACHE_SIZE", 1000)),
+            chunk_guilds_at_startup=None if chunk_override is None else chunk_override.lower() == "true",
+        )
+    except ValueError as e:
+        logger.error("%s", e)
+        exit(1)
+
+    # cooldowns live in the database by default so they survive restarts and are shared between processes
+    if os.environ.get("COOLDOWN_STORE", "sql").lower() == "memory":
+        cooldown_store = MemoryCooldownStore()
+    else:
+        cooldown_store = SQLCooldownStore(Session)
+
+
+def find_legacy_rowid_tables() -> set:
+    """
+    Find the SQLite roll tables that reuse IDs once they are emptied.
+    sqlite_autoincrement only applies when a table is created, so databases from before it was set keep the old behaviour
+
+    Returns:
+        set: Names of the tables, always empty for other databases
+    """
+    if engine.dialect.name != "sqlite":  # type: ignore
+        return set()
+    with engine.connect() as connection:  # type: ignore
+        rows = connection.execute(
+            sqlalchemy.text(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ('rolls', 'doublerolls')"
+            )
+        )
+        return {name for name, sql in rows if "AUTOINCREMENT" not in sql.upper()}
+
 
-engine = create_engine(database_url, pool_use_lifo=True, pool_pre_ping=True)
+def create_read_engine(url: str) -> sqlalchemy.Engine:
+    """
+    Create the engine reports and analytics read from. Writes through it fail instead of landing on the replica
 
-Session = sessionmaker(bind=engine)
-session = Session()
+    Args:
+        url (str): Database URL of the read database
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
+    Returns:
+        Engine: The read only engine
+    """
+    read_only = create_engine(url, pool_use_lifo=True, pool_pre_ping=True)
+    if read_only.dialect.name == "postgresql":
+        return read_only.execution_options(postgresql_readonly=True)
+    if read_only.dialect.name == "sqlite":
 
-Base.metadata.create_all(engine)
+        @sqlalchemy.event.listens_for(read_only, "connect")
+        def query_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+
+    else:
+        logger.warning("Can't make a %s read engine read only, writes through it will go through", read_only.dialect.name)
+    return read_only
+
+
+def connect_database() -> None:
+    """
+    Startup phase: connects to the database and creates any missing tables.
+    The read database is expected to be a copy of the main one, its schema is left alone
+    """
+    global engine, read_engine, session, legacy_rowid_tables
+
+    engine = create_engine(database_url, pool_use_lifo=True, pool_pre_ping=True)
+    Session.configure(bind=engine)
+    session = Session()
+
+    Base.metadata.create_all(engine)
+    legacy_rowid_tables = find_legacy_rowid_tables()
+    for table in sorted(legacy_rowid_tables):
+        logger.warning(
+            "The %s table was made without AUTOINCREMENT, create_all can't fix that. "
+            "Archiving will never empty it, since SQLite would hand out old IDs again and break the roll snapshot. "
+            "Rebuild the table with AUTOINCREMENT to archive it fully",
+            table,
+        )
+
+    if read_database_url == database_url:
+        # no replica to protect, share the main pool
+        read_engine = engine
+    else:
+        read_engine = create_read_engine(read_database_url)
+        logger.info("Reports read from a separate database")
 
 
 # DB functions
@@ -142,8 +309,9 @@ def insert_roll(user_id: int, roll: int, timestamp: datetime.datetime) -> None:
         roll (int): The roll they rolled (1-12)
         timestamp (datetime.datetime): datetime of the roll
     """
-    roll = Rolls(user_id=user_id, roll=roll, timestamp=timestamp)
-    session.add(roll)
+    # streaks first, so a catch up rebuild only sees the rolls from before this one
+    update_streak(user_id, roll, timestamp)
+    session.add(Rolls(user_id=user_id, roll=roll, timestamp=timestamp))
     session.commit()
 
 def insert_doubleroll(user_id: int, timestamp: datetime.datetime) -> None:
@@ -159,7 +327,7 @@ def insert_doubleroll(user_id: int, timestamp: datetime.datetime) -> None:
     session.commit()
 
 
-def remove_roll(user_id: int, timestamp: datetime.datetime, removed_by: int) -> None:
+def remove_roll(user_id: int, timestamp: datetime.datetime, removed_by: int) -> bool:
     """
     Remove a roll from the database
 
@@ -167,11 +335,230 @@ def remove_roll(user_id: int, timestamp: datetime.datetime, removed_by: int) ->
         user_id (int): Discord User ID
         timestamp (datetime.datetime): datetime of the roll
         removed_by (int): Discord User ID of the user who removed the roll
+
+    Returns:
+        bool: If a roll was found and removed
+    """
+    _, removed = void_rolls(removed_by, user_id=user_id, start=timestamp, end=timestamp)
+    return bool(removed)
+
+
+def roll_filter(
+    source,
+    user_id: Optional[int] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    roll: Optional[int] = None,
+) -> list:
+    """
+    Build the WHERE clauses for picking out rolls for moderation
+
+    Args:
+        source (Table): The rolls table or one of its archive tables
+        user_id (int, optional): Only rolls by this Discord User ID
+        start (datetime.datetime, optional): Only rolls made at or after this time
+        end (datetime.datetime, optional): Only rolls made at or before this time
+        roll (int, optional): Only rolls of this value (1-12)
+
+    Returns:
+        list: Clauses to pass to .where(), only rolls that haven't been removed match
+    """
+    clauses = [sqlalchemy.or_(source.c.roll_removed == False, source.c.roll_removed.is_(None))]  # noqa: E712
+    if user_id is not None:
+        clauses.append(source.c.user_id == user_id)
+    if start is not None:
+        clauses.append(source.c.timestamp >= start)
+    if end is not None:
+        clauses.append(source.c.timestamp <= end)
+    if roll is not None:
+        clauses.append(source.c.roll == roll)
+    return clauses
+
+
+def preview_void_rolls(
+    user_id: Optional[int] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    roll: Optional[int] = None,
+) -> list:
+    """
+    Get the rolls void_rolls would remove, without changing anything
+
+    Args:
+        user_id (int, optional): Only rolls by this Discord User ID
+        start (datetime.datetime, optional): Only rolls made at or after this time
+        end (datetime.datetime, optional): Only rolls made at or before this time
+        roll (int, optional): Only rolls of this value (1-12)
+
+    Returns:
+        list: (roll_id, user_id, roll, timestamp) rows of the matching rolls, oldest first
+    """
+    rolls = []
+    for source in all_roll_sources():
+        rolls.extend(
+            session.execute(
+                sqlalchemy.select(source.c.roll_id, source.c.user_id, source.c.roll, source.c.timestamp)
+                .where(*roll_filter(source, user_id, start, end, roll))
+                .order_by(source.c.timestamp)
+            ).all()
+        )
+    return rolls
+
+
+def void_rolls(
+    removed_by: int,
+    user_id: Optional[int] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    roll: Optional[int] = None,
+) -> Tuple[Optional[int], list]:
+    """
+    Remove every roll matching the filters, one UPDATE for the rolls table and each archive table.
+    The removed rolls are recorded as a void batch so restore_rolls can undo exactly this call
+
+    Args:
+        removed_by (int): Discord User ID of the user who removed the rolls
+        user_id (int, optional): Only rolls by this Discord User ID
+        start (datetime.datetime, optional): Only rolls made at or after this time
+        end (datetime.datetime, optional): Only rolls made at or before this time
+        roll (int, optional): Only rolls of this value (1-12)
+
+    Returns:
+        Tuple[Optional[int], list]: ID of the void batch (None if nothing matched)
+        and (roll_id, user_id) rows of the rolls that were removed
+    """
+    removed = []
+    for source in all_roll_sources():
+        removed.extend(
+            session.execute(
+                sqlalchemy.update(source)
+                .where(*roll_filter(source, user_id, start, end, roll))
+                .values(roll_removed=True, removed_by=removed_by)
+                .returning(source.c.roll_id, source.c.user_id)
+            ).all()
+        )
+    if not removed:
+        session.commit()
+        return None, removed
+
+    filters = dict(user_id=user_id, start=start, end=end, roll=roll)
+    batch = VoidBatches(
+        removed_by=removed_by,
+        filters=", ".join(f"{name}={value}" for name, value in filters.items() if value is not None),
+        roll_count=len(removed),
+    )
+    session.add(batch)
+    session.flush()
+    session.execute(
+        sqlalchemy.insert(VoidedRolls),
+        [{"batch_id": batch.batch_id, "roll_id": row.roll_id} for row in removed],
+    )
+    # removing a roll can split a streak anywhere in the history, so rebuild the affected users
+    rebuild_user_streaks(row.user_id for row in removed)
+    session.commit()
+    return batch.batch_id, removed
+
+
+def get_void_batch(batch_id: int) -> Optional[VoidBatches]:
+    """
+    Get a void batch
+
+    Args:
+        batch_id (int): ID of the batch
+
+    Returns:
+        VoidBatches or None: The batch, None if there isn't one with that ID
+    """
+    return session.get(VoidBatches, batch_id)
+
+
+def recent_void_batches(removed_by: int, limit: int = 10) -> list:
+    """
+    Get the latest void batches by a user that haven't been undone
+
+    Args:
+        removed_by (int): Discord User ID of the user who voided the rolls
+        limit (int): Most batches to get
+
+    Returns:
+        list: VoidBatches, newest first
+    """
+    return (
+        session.query(VoidBatches)
+        .filter(VoidBatches.removed_by == removed_by, VoidBatches.restored_at.is_(None))
+        .order_by(VoidBatches.batch_id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def batch_roll_filter(source, batch: VoidBatches) -> list:
+    """
+    Build the WHERE clauses for the rolls of a void batch that are still removed.
+    Rolls put back or removed again since don't match
+
+    Args:
+        source (Table): The rolls table or one of its archive tables
+        batch (VoidBatches): The void batch
+
+    Returns:
+        list: Clauses to pass to .where()
     """
-    roll = session.query(Rolls).filter_by(user_id=user_id, timestamp=timestamp).first()
-    roll.roll_removed = True  # type: ignore
-    roll.removed_by = removed_by  # type: ignore
+    return [
+        source.c.roll_id.in_(
+            sqlalchemy.select(VoidedRolls.roll_id).where(VoidedRolls.batch_id == batch.batch_id)
+        ),
+        source.c.roll_removed == True,  # noqa: E712
+        source.c.removed_by == batch.removed_by,
+    ]
+
+
+def preview_restore_rolls(batch: VoidBatches) -> list:
+    """
+    Get the rolls restore_rolls would put back, without changing anything
+
+    Args:
+        batch (VoidBatches): The void batch to undo
+
+    Returns:
+        list: (roll_id, user_id, roll, timestamp) rows of the rolls, oldest first
+    """
+    rolls = []
+    for source in all_roll_sources():
+        rolls.extend(
+            session.execute(
+                sqlalchemy.select(source.c.roll_id, source.c.user_id, source.c.roll, source.c.timestamp)
+                .where(*batch_roll_filter(source, batch))
+                .order_by(source.c.timestamp)
+            ).all()
+        )
+    return rolls
+
+
+def restore_rolls(batch: VoidBatches) -> list:
+    """
+    Undo one void_rolls call, putting back the rolls of its batch wherever they have been archived to
+
+    Args:
+        batch (VoidBatches): The void batch to undo
+
+    Returns:
+        list: (roll_id, user_id) rows of the rolls that were restored
+    """
+    restored = []
+    for source in all_roll_sources():
+        restored.extend(
+            session.execute(
+                sqlalchemy.update(source)
+                .where(*batch_roll_filter(source, batch))
+                .values(roll_removed=False, removed_by=None)
+                .returning(source.c.roll_id, source.c.user_id)
+            ).all()
+        )
+    batch.restored_at = datetime.datetime.now()  # type: ignore
+    rebuild_user_streaks(row.user_id for row in restored)
     session.commit()
+    return restored
 
 
 def update_username(user_id: int, username: str) -> None:
@@ -209,134 +596,501 @@ def get_last_roll_timestamp(user_id: int) -> Optional[str]:
         return None
 
 
+class RollRow(NamedTuple):
+    """
+    A roll as it appears in reports
+    """
+
+    username: str
+    roll: int
+    timestamp: datetime.datetime
+    removed: Union[bool, str]
+    removed_by: Union[int, str, None]
+
+
+class DoubleRollRow(NamedTuple):
+    """
+    A double roll as it appears in reports
+    """
+
+    username: str
+    timestamp: datetime.datetime
+
+
+def month_range(month: int, year: int) -> tuple:
+    """
+    Get the start of a month and the start of the month after it
+
+    Args:
+        month (int): Month (1-12)
+        year (int): Year
+
+    Returns:
+        tuple: The two datetimes, for timestamp >= start and timestamp < end filters
+    """
+    return (
+        datetime.datetime(year, month, 1),
+        datetime.datetime(year + month // 12, month % 12 + 1, 1),
+    )
+
+
+def roll_report_rows(connection: sqlalchemy.Connection, statement) -> list:
+    """
+    Run a Core select of username, roll, timestamp, roll_removed, removed_by and turn it into report rows.
+    Goes straight through a connection so nothing ends up in the session's identity map
+
+    Args:
+        connection (Connection): Connection to the read database
+        statement (Select): The select to run
+
+    Returns:
+        list: RollRow for each roll, removed columns say "Not Removed" if the roll wasn't removed
+    """
+    return [
+        RollRow(
+            username,
+            roll,
+            timestamp,
+            roll_removed if roll_removed else "Not Removed",
+            removed_by if roll_removed else "Not Removed",
+        )
+        for username, roll, timestamp, roll_removed, removed_by in connection.execute(statement)
+    ]
+
+
+def roll_report_select(source):
+    """
+    Build the select used by the roll reports for a rolls or archive table
+
+    Args:
+        source (Table): The table to read
+
+    Returns:
+        Select: username, roll, timestamp, roll_removed and removed_by of every roll
+    """
+    users = User.__table__
+    return sqlalchemy.select(
+        users.c.username,
+        source.c.roll,
+        source.c.timestamp,
+        source.c.roll_removed,
+        source.c.removed_by,
+    ).join_from(source, users, source.c.user_id == users.c.userid)
+
+
 def get_user_rolls(user_id: int, month: int, year: int):
     """
     Get all rolls for a given month and year for a user
 
     Args:
-        user_id (int): Discord User ID of the user
-        month (int): Month to get rolls for (1-12)
-        year (int): Year to get rolls for
+        user_id (int): Discord User ID of the user
+        month (int): Month to get rolls for (1-12)
+        year (int): Year to get rolls for
+
+    Returns:
+        list: RollRow for each of the user's rolls in the given month and year
+    """
+    start, end = month_range(month, year)
+    with read_engine.connect() as connection:  # type: ignore
+        source = rolls_source(month, year, connection)
+        return roll_report_rows(
+            connection,
+            roll_report_select(source).where(
+                source.c.timestamp >= start,
+                source.c.timestamp < end,
+                source.c.user_id == user_id,
+            ),
+        )
+
+
+def get_rolls(month: int, year: int):
+    """
+    Get all rolls for a given month and year
+
+    Args:
+        month (int): Month to get rolls for (1-12)
+        year (int): Year to get rolls for
+
+    Returns:
+        list: RollRow for each roll in the given month and year
+    """
+    start, end = month_range(month, year)
+    with read_engine.connect() as connection:  # type: ignore
+        source = rolls_source(month, year, connection)
+        return roll_report_rows(
+            connection,
+            roll_report_select(source).where(
+                source.c.timestamp >= start, source.c.timestamp < end
+            ),
+        )
+
+
+def get_all_rolls():
+    """
+    Get all rolls from the database
+
+    Returns:
+        list: RollRow for every roll, removed is a bool and removed_by is None if the roll wasn't removed
+    """
+    rolls_list = []
+    with read_engine.connect() as connection:  # type: ignore
+        for source in all_roll_sources(connection):
+            for username, roll, timestamp, roll_removed, removed_by in connection.execute(
+                roll_report_select(source)
+            ):
+                rolls_list.append(
+                    RollRow(username, roll, timestamp, roll_removed, removed_by if roll_removed else None)
+                )
+    return rolls_list
+
+def get_double_rolls(month: int, year: int):
+    """
+    Get all double rolls for a given month and year
+
+    Args:
+        month (int): Month to get rolls for (1-12)
+        year (int): Year to get rolls for
+
+    Returns:
+        list: DoubleRollRow for each double roll in the given month and year
+    """
+    users = User.__table__
+    start, end = month_range(month, year)
+    with read_engine.connect() as connection:  # type: ignore
+        source = doublerolls_source(month, year, connection)
+        statement = (
+            sqlalchemy.select(users.c.username, source.c.timestamp)
+            .join_from(source, users, source.c.user_id == users.c.userid)
+            .where(source.c.timestamp >= start, source.c.timestamp < end)
+        )
+        return [DoubleRollRow(*row) for row in connection.execute(statement)]
+
+
+def update_streak(user_id: int, roll: int, timestamp: datetime.datetime) -> None:
+    """
+    Apply a new roll to the user's streaks. Call it before the roll is added. Does not commit, the caller does
+
+    Args:
+        user_id (int): Discord User ID
+        roll (int): The roll they rolled (1-12)
+        timestamp (datetime.datetime): datetime of the roll
+    """
+    streak = session.get(Streaks, user_id)
+    if streak is None:
+        # users who rolled before the streaks table existed get their history replayed once
+        rebuild_user_streak(user_id)
+        streak = session.get(Streaks, user_id)
+    advance_streak(streak, roll, timestamp.date())
+
+
+def roll_history(user_ids: Optional[Iterable[int]] = None) -> dict:
+    """
+    Get the roll history of users, one query for the rolls table and each archive table
+
+    Args:
+        user_ids (Iterable[int], optional): Only these Discord User IDs, defaults to everyone
+
+    Returns:
+        dict: (roll, timestamp) pairs for each user ID, oldest first
+    """
+    history = {}
+    # archives come back oldest first, so each user's history stays in order
+    for source in all_roll_sources():
+        query = session.query(source.c.user_id, source.c.roll, source.c.timestamp).filter(
+            sqlalchemy.or_(source.c.roll_removed == False, source.c.roll_removed.is_(None))  # noqa: E712
+        )
+        if user_ids is not None:
+            query = query.filter(source.c.user_id.in_(user_ids))
+        for roll in query.order_by(source.c.user_id, source.c.timestamp):
+            history.setdefault(roll.user_id, []).append((roll.roll, roll.timestamp))
+    return history
+
+
+def rebuild_user_streaks(user_ids: Iterable[int]) -> None:
+    """
+    Rebuild the streaks for some users from their roll history. Does not commit, the caller does
+
+    Args:
+        user_ids (Iterable[int]): Discord User IDs
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    history = roll_history(user_ids)
+    streaks = {
+        streak.user_id: streak
+        for streak in session.query(Streaks).filter(Streaks.user_id.in_(user_ids))
+    }
+    for user_id in user_ids:
+        streak = streaks.get(user_id)
+        if streak is None:
+            streak = Streaks(user_id=user_id)
+            session.add(streak)
+        replay_streak(streak, history.get(user_id, []))
+
+
+def rebuild_user_streak(user_id: int) -> None:
+    """
+    Rebuild the streaks for a single user from their roll history. Does not commit, the caller does
+
+    Args:
+        user_id (int): Discord User ID
+    """
+    rebuild_user_streaks([user_id])
+
+
+def rebuild_streaks() -> int:
+    """
+    Rebuild the streaks for every user from the full roll history
+
+    Returns:
+        int: Number of users that had their streaks rebuilt
+    """
+    history = roll_history()
+    session.query(Streaks).delete()
+    for user_id, user_rolls in history.items():
+        streak = Streaks(user_id=user_id)
+        replay_streak(streak, user_rolls)
+        session.add(streak)
+    session.commit()
+    return len(history)
+
+
+def get_streak(user_id: int) -> Optional[Streaks]:
+    """
+    Get the precomputed streaks for a user
+
+    Args:
+        user_id (int): Discord User ID
+
+    Returns:
+        Streaks or None: The user's streaks or None if they have never rolled
+    """
+    return session.get(Streaks, user_id)
+
+
+def archived_periods(source: str, connection: Optional[sqlalchemy.Connection] = None) -> list:
+    """
+    Get every month that has been archived for a table
+
+    Args:
+        source (str): The archived table, rolls or doublerolls
+        connection (Connection, optional): Where to look, defaults to the session on the main database
+
+    Returns:
+        list: (year, month) pairs, oldest first
+    """
+    return [
+        (period.year, period.month)
+        for period in (connection or session).execute(
+            sqlalchemy.select(ArchivedPeriods.year, ArchivedPeriods.month)
+            .where(ArchivedPeriods.source == source)
+            .order_by(ArchivedPeriods.year, ArchivedPeriods.month)
+        )
+    ]
+
+
+def is_archived(
+    source: str, month: int, year: int, connection: Optional[sqlalchemy.Connection] = None
+) -> bool:
+    """
+    Check if a month of a table has been moved into an archive table
+
+    Args:
+        source (str): The archived table, rolls or doublerolls
+        month (int): Month to check (1-12)
+        year (int): Year to check
+        connection (Connection, optional): Where to look, defaults to the session on the main database
+
+    Returns:
+        bool: If the month has been archived
+    """
+    return (
+        (connection or session).execute(
+            sqlalchemy.select(ArchivedPeriods.table_name).where(
+                ArchivedPeriods.table_name == archive_table_name(source, year, month)
+            )
+        ).first()
+        is not None
+    )
+
+
+def rolls_source(month: int, year: int, connection: Optional[sqlalchemy.Connection] = None):
+    """
+    Get the table to read a month of rolls from, either the rolls table or its archive table
+
+    Args:
+        month (int): Month to read (1-12)
+        year (int): Year to read
+        connection (Connection, optional): Database the month will be read from, defaults to the main database
+
+    Returns:
+        Table: The table holding the month
+    """
+    if is_archived("rolls", month, year, connection):
+        return rolls_archive_table(year, month)
+    return Rolls.__table__
+
+
+def doublerolls_source(month: int, year: int, connection: Optional[sqlalchemy.Connection] = None):
+    """
+    Get the table to read a month of double rolls from, either the doublerolls table or its archive table
+
+    Args:
+        month (int): Month to read (1-12)
+        year (int): Year to read
+        connection (Connection, optional): Database the month will be read from, defaults to the main database
+
+    Returns:
+        Table: The table holding the month
+    """
+    if is_archived("doublerolls", month, year, connection):
+        return doublerolls_archive_table(year, month)
+    return DoubleRolls.__table__
+
+
+def all_roll_sources(connection: Optional[sqlalchemy.Connection] = None) -> list:
+    """
+    Get every table rolls can be read from, oldest archive first and the rolls table last
+
+    Args:
+        connection (Connection, optional): Database the rolls will be read from, defaults to the main database
 
     Returns:
-        List: _description_
+        list: Each archive table, then the rolls table
     """
-    rolls = (
-        session.query(Rolls, User)
-        .filter(
-            extract("month", Rolls.timestamp) == month,
-            extract("year", Rolls.timestamp) == year,
-        )
-        .filter(Rolls.user_id == user_id)
-        .filter(Rolls.user_id == User.userid)
-        .all()
-    )
-    rolls_list = []
-    for roll in rolls:
-        rolls_list.append(
-            [
-                roll.User.username,
-                roll.Rolls.roll,
-                roll.Rolls.timestamp,
-                roll.Rolls.roll_removed if roll.Rolls.roll_removed else "Not Removed",
-                roll.Rolls.removed_by if roll.Rolls.roll_removed else "Not Removed",
-            ]
-        )
-    return rolls_list
+    return [
+        rolls_archive_table(year, month) for year, month in archived_periods("rolls", connection)
+    ] + [Rolls.__table__]
 
 
-def get_rolls(month: int, year: int):
+def archive_month(year: int, month: int) -> tuple:
     """
-    Get all rolls for a given month and year
+    Move a month of rolls and doublerolls out of the live tables into their archive tables
 
     Args:
-        month (int): Month to get rolls for (1-12)
-        year (int): Year to get rolls for
+        year (int): Year to archive
+        month (int): Month to archive (1-12)
 
     Returns:
-        list: A list of all rolls for the given month and year
+        tuple: Number of rolls and doublerolls moved
     """
-    # rolls = session.query(Rolls).filter(Rolls.timestamp.like(datetime.date(year=year,month=month))).all()
-    rolls = (
-        session.query(Rolls, User)
-        .filter(
-            extract("month", Rolls.timestamp) == month,
-            extract("year", Rolls.timestamp) == year,
+    start, end = month_range(month, year)
+    moved = []
+    for source, model, table in (
+        ("rolls", Rolls, rolls_archive_table(year, month)),
+        ("doublerolls", DoubleRolls, doublerolls_archive_table(year, month)),
+    ):
+        columns = [column.name for column in table.columns]
+        in_month = (model.timestamp >= start, model.timestamp < end)
+        count = session.query(sqlalchemy.func.count()).select_from(model).where(*in_month).scalar()
+        if not count:
+            # don't leave empty archive tables behind for quiet months
+            moved.append(0)
+            continue
+        if model.__tablename__ in legacy_rowid_tables and count == session.query(model).count():
+            logger.warning(
+                "Not archiving %s for %s-%02d, it would empty a table that reuses IDs", source, year, month
+            )
+            moved.append(0)
+            continue
+        table.create(session.connection(), checkfirst=True)
+        session.execute(
+            sqlalchemy.insert(table).from_select(
+                columns,
+                sqlalchemy.select(*[getattr(model, column) for column in columns]).where(*in_month),
+            )
         )
-        .filter(Rolls.user_id == User.userid)
-        # .filter(Rolls.removed_by == User.userid)
-        .all()
-    )
-    rolls_list = []
-    for roll in rolls:
-        rolls_list.append(
-            [
-                roll.User.username,
-                roll.Rolls.roll,
-                roll.Rolls.timestamp,
-                roll.Rolls.roll_removed if roll.Rolls.roll_removed else "Not Removed",
-                roll.Rolls.removed_by if roll.Rolls.roll_removed else "Not Removed",
-            ]
+        session.execute(
+            sqlalchemy.delete(model).where(*in_month),
+            execution_options={"synchronize_session": False},
         )
-    return rolls_list
 
-    # rolls = session.query(Rolls).filter(Rolls.timestamp.like(f"{year_month}%")).all()
-    # rolls_list = []
-    # for roll in rolls:
-    #     rolls_list.append([roll.users.username, roll.roll, roll.timestamp, roll.removed, roll.removed_by.username if roll.removed_by else None])
-    # return rolls_list
+        period = session.get(ArchivedPeriods, table.name)
+        if period is None:
+            period = ArchivedPeriods(table_name=table.name, source=source, year=year, month=month, row_count=0)
+            session.add(period)
+        period.row_count += count
+        period.archived_at = datetime.datetime.now()
+        moved.append(count)
+    session.commit()
+    # anything from the moved month still in the identity map is no longer in the live table
+    session.expire_all()
+    return tuple(moved)
 
 
-def get_all_rolls():
+def archive_rolls(keep_months: int = 1) -> list:
     """
-    Get all rolls from the database
+    Archive every closed month of rolls and doublerolls older than keep_months
+
+    Args:
+        keep_months (int): Number of months to leave in the live tables, counting the current month
 
     Returns:
-        list: A list of all rolls
+        list: (year, month, rolls moved, doublerolls moved) for each archived month
     """
-    rolls = session.query(Rolls, User).filter(Rolls.user_id == User.userid).all()
-    rolls_list = []
-    for roll in rolls:
-        rolls_list.append(
-            [
-                roll.User.username,
-                roll.Rolls.roll,
-                roll.Rolls.timestamp,
-                roll.Rolls.roll_removed,
-                roll.Rolls.removed_by if roll.roll_removed else None,
-            ]
-        )
-    return rolls_list
+    today = datetime.date.today()
+    cutoff_index = today.year * 12 + today.month - 1 - max(keep_months, 1) + 1
+    oldest = [
+        session.query(sqlalchemy.func.min(model.timestamp)).scalar()
+        for model in (Rolls, DoubleRolls)
+    ]
+    oldest = [timestamp for timestamp in oldest if timestamp is not None]
+    if not oldest:
+        return []
+    first = min(oldest)
+
+    archived = []
+    for index in range(first.year * 12 + first.month - 1, cutoff_index):
+        year, month = divmod(index, 12)
+        rolls, doublerolls = archive_month(year, month + 1)
+        if rolls or doublerolls:
+            archived.append((year, month + 1, rolls, doublerolls))
+    return archived
+
+
+def refresh_roll_snapshot() -> RollSnapshot:
+    """
+    Bring the columnar roll snapshot up to date.
+    Only rolls past the snapshot's high water mark are read, plus the IDs of removed rolls
 
-def get_double_rolls(month: int, year: int):
+    Returns:
+        RollSnapshot: The up to date snapshot
     """
-    Get all double rolls for a given month and year
+    snapshot = RollSnapshot(snapshot_path)
+    new_rolls = []
+    removed_ids = []
+    with read_engine.connect() as connection:  # type: ignore
+        for source in all_roll_sources(connection):
+            new_rolls.extend(
+                connection.execute(
+                    sqlalchemy.select(
+                        source.c.roll_id, source.c.user_id, source.c.roll, source.c.timestamp, source.c.roll_removed
+                    )
+                    .where(source.c.roll_id > snapshot.high_water_mark)
+                    .order_by(source.c.roll_id)
+                ).all()
+            )
+            removed_ids.extend(
+                connection.execute(
+                    sqlalchemy.select(source.c.roll_id).where(source.c.roll_removed == True)  # noqa: E712
+                ).scalars()
+            )
+    new_rolls.sort(key=lambda roll: roll.roll_id)
+    snapshot.append(new_rolls)
+    snapshot.sync_removed(sorted(removed_ids))
+    return snapshot
 
-    Args:
-        month (int): Month to get rolls for (1-12)
-        year (int): Year to get rolls for
+
+def get_usernames() -> dict:
+    """
+    Get the username of every user
 
     Returns:
-        list: A list of all double rolls for the given month and year
+        dict: Discord User ID to username
     """
-    double_rolls = (
-        session.query(DoubleRolls, User)
-        .filter(
-            extract("month", DoubleRolls.timestamp) == month,
-            extract("year", DoubleRolls.timestamp) == year,
-        )
-        .filter(DoubleRolls.user_id == User.userid)
-        .all()
-    )
-    double_rolls_list = []
-    for roll in double_rolls:
-        double_rolls_list.append(
-            [
-                roll.User.username,
-                roll.DoubleRolls.timestamp,
-            ]
-        )
-    return double_rolls_list
+    with read_engine.connect() as connection:  # type: ignore
+        return dict(connection.execute(sqlalchemy.select(User.userid, User.username)).all())
 
 #endregion
 
@@ -345,41 +1099,75 @@ def get_double_rolls(month: int, year: int):
 #     return f"{user_id}{timestamp.month}{timestamp.day}"
 
 
+class BotTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # runs before any command check, so capabilities match the roles Discord just sent us.
+        # Without the full member cache Discord's member update events are dropped, so this is how roles stay fresh.
+        # The bitset is only recomputed when those roles differ from the ones it was indexed with
+        recent_members.add(interaction.user)
+        if not member_cache.caches_everyone:
+            permission_index.update_member(interaction.user)  # type: ignore
+        return True
+
+
 class MyClient(discord.Client):
     def __init__(self, *, intents: discord.Intents):
         super().__init__(
             intents=intents,
             status=discord.Status.do_not_disturb,
             activity=discord.Game(name="some sick beats with ur dad"),
+            member_cache_flags=member_cache.flags,
+            chunk_guilds_at_startup=member_cache.chunk_guilds_at_startup,
         )
 
-        self.tree = app_commands.CommandTree(self)
+        self.tree = BotTree(self)
 
-    async def setup_hook(self):
-        # This copies the global commands over to your guild.
-        if DEV:
-            self.tree.copy_global_to(guild=MY_GUILD)
-            await self.tree.sync(guild=MY_GUILD)
-            # self.tree.copy_global_to(guild=TEST_GUILD)
-            # await self.tree.sync(guild=TEST_GUILD)
-            logger.info("Copied global commands to dev guilds")
-        else:
-            await self.tree.sync()
+
+# Bot events
+async def on_ready():
+    logger.info("%s has connected to Discord!", bot.user)
+    logger.info(
+        "Invite URL is: https://discord.com/api/oauth2/authorize?client_id=%s&permissions=0&scope=bot%%20applications.commands",
+        bot.user.id,  # type: ignore
+    )
+    # on_ready fires again after every reconnect, only the first one is part of startup
+    if startup_timer.end("gateway ready") is not None:
+        logger.info("Startup finished: %s", startup_timer.report())
+    logger.info("Ready, %s", cache_report(bot, member_cache, recent_members))
 
 
-bot = MyClient(intents=intents)
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles != after.roles:
+        permission_index.update_member(after)
 
 
-# Bot events
-@bot.event
-async def on_ready():
-    logger.info(f"{bot.user} has connected to Discord!")
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # the raw event fires whether or not the member was cached
+    recent_members.discard(payload.guild_id, payload.user.id)
+    permission_index.forget_member(payload.guild_id, payload.user.id)
+
+
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    permission_index.update_role(after)
+
+
+async def on_guild_role_delete(role: discord.Role):
+    permission_index.update_role(role)
+
+
+async def on_app_command_completion(
+    interaction: discord.Interaction, command: Union[app_commands.Command, app_commands.ContextMenu]
+):
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
     logger.info(
-        f"Invite URL is: https://discord.com/api/oauth2/authorize?client_id={bot.user.id}&permissions=0&scope=bot%20applications.commands"  # type: ignore
+        "%s finished %s in %.3f seconds",
+        interaction.user.name,
+        command.qualified_name,
+        latency,
+        extra=interaction_fields(interaction, latency=latency),
     )
 
 
-@bot.tree.error
 async def on_app_command_error(
     interaction: discord.Interaction, exception: app_commands.AppCommandError
 ):
@@ -395,12 +1183,19 @@ async def on_app_command_error(
             f"You are on cooldown, try again in {round(exception.retry_after, 2)} seconds",
             ephemeral=True,
         )
-        logging.info(
-            f"{interaction.user.name} tried to use a command on cooldown. This has been logged for debug purposes"
+        logger.info(
+            "%s tried to use a command on cooldown. This has been logged for debug purposes",
+            interaction.user.name,
+            extra=interaction_fields(interaction),
         )
         return
     else:
-        logging.error(f"{interaction.command.name} raised an exception: {exception}")  # type: ignore
+        logger.error(
+            "%s raised an exception: %s",
+            interaction.command.name,  # type: ignore
+            exception,
+            extra=interaction_fields(interaction),
+        )
         try:
             await interaction.response.defer(ephemeral=True)
         except discord.errors.InteractionResponded:
@@ -413,13 +1208,27 @@ async def on_app_command_error(
         return
 
 
+def authorized(interaction: discord.Interaction, capability: Capability) -> bool:
+    """
+    Checks if the user behind an interaction has any of the given capabilities
+
+    Args:
+        interaction (discord.Interaction): Discord interaction
+        capability (Capability): One or more capabilities, any of them is enough
+
+    Returns:
+        bool: If the user is allowed
+    """
+    return permission_index.allowed(interaction.user, capability)
+
+
 # cooldown handler
 def cooldown_handler(
     interaction: discord.Interaction,
 ) -> Optional[app_commands.Cooldown]:
     """Bypasses the cooldown for the owner and other admins, otherwise returns the cooldown."""
     # user = get_user(interaction.user.id)
-    if interaction.user.id in debug_users:  # type: ignore # user is not none
+    if authorized(interaction, Capability.DEBUG):
         return None
     return app_commands.Cooldown(1, 600)
 
@@ -447,14 +1256,8 @@ def cooldown_handler(
 
 
 #     messages = [message async for message in interaction.channel.history(limit=num_messages)]
-#     extracted = []
-#     for message in messages:
-#         if message.author.id in bots:
-#             continue
-#         extracted.append(
-#             f'{message.author.display_name} : {message.content} \n')
-#     extracted.reverse()
-#     text = ''.join(str(value) for value in extracted)
+#     text, report = build_transcript(reversed(messages), bots, transcript_rules)
+#     logger.info("TLDR transcript: %s", report, extra=interaction_fields(interaction))
 #     await interaction.response.send_message("Messages have been sent to the job queue! I will eventually post the summary here 🤖")
 #     followup = interaction.followup
 #     logging.debug(followup)
@@ -470,7 +1273,7 @@ def cooldown_handler(
 #     await ctx.respond(summarizer.get_inference_params())
 
 
-@bot.tree.command()
+@app_commands.command()
 async def ping(interaction: discord.Interaction):
     """
     Gets the ping from the bot to discord's gateway
@@ -497,9 +1300,9 @@ class Units(Enum):
 
 
 # @bot.slash_command(name="convert", description="Converts units to Nikez", cooldown=CooldownMapping(Cooldown(1, 600), BucketType.user), on_application_command_error=on_application_command_error)
-@bot.tree.command()
+@app_commands.command()
 # @app_commands.checks.cooldown(1,600, key=lambda i: (i.guild_id, i.user.id))
-@app_commands.checks.dynamic_cooldown(cooldown_handler)
+@shared_cooldown(lambda: cooldown_store, cooldown_handler)
 @app_commands.guild_only()
 @app_commands.describe(num="Number to convert")
 @app_commands.describe(unit="Unit to convert")
@@ -508,7 +1311,7 @@ async def convertnikez(interaction: discord.Interaction, num: float, unit: Units
     Converts units to Nikez
     """
     # check user is in sub role
-    if sub_role not in [role.id for role in interaction.user.roles]:  # type: ignore
+    if not authorized(interaction, Capability.SUBSCRIBER):
         await interaction.response.send_message(
             "You must be a subscriber to use this command", ephemeral=True
         )
@@ -522,8 +1325,13 @@ async def convertnikez(interaction: discord.Interaction, num: float, unit: Units
         )
         return
 
-    logging.info(
-        f"{interaction.user.name} converted {num} {unit.name}:{unit.value} to Nikez"
+    logger.info(
+        "%s converted %s %s:%s to Nikez",
+        interaction.user.name,
+        num,
+        unit.name,
+        unit.value,
+        extra=interaction_fields(interaction),
     )
     # calculate conversion
     converted = num * unit.value / 1.87
@@ -532,9 +1340,9 @@ async def convertnikez(interaction: discord.Interaction, num: float, unit: Units
 
 # pitroll, can only be run in the pit channel
 # @bot.slash_command(name="pitroll", description="Rolls a random number between 1 and 12")
-@bot.tree.command()
+@app_commands.command()
 # @app_commands.checks.cooldown(1,600, key=lambda i: (i.guild_id, i.user.id))
-@app_commands.checks.dynamic_cooldown(cooldown_handler)
+@shared_cooldown(lambda: cooldown_store, cooldown_handler)
 @app_commands.guild_only()
 async def pitroll(interaction: discord.Interaction):
     """
@@ -552,7 +1360,12 @@ async def pitroll(interaction: discord.Interaction):
             ),
             ephemeral=True,
         )
-        logging.info(f"{interaction.user.name} tried to use pitroll in {interaction.channel.name}")  # type: ignore
+        logger.info(
+            "%s tried to use pitroll in %s",
+            interaction.user.name,
+            interaction.channel.name,  # type: ignore
+            extra=interaction_fields(interaction),
+        )
         return
 
     await interaction.response.defer()
@@ -566,7 +1379,12 @@ async def pitroll(interaction: discord.Interaction):
 
     # '2023-06-09 15:18:43.526048' format
     last_roll_str = get_last_roll_timestamp(interaction.user.id)
-    logging.info(f"Last roll for {interaction.user.name} was {last_roll_str}")
+    logger.info(
+        "Last roll for %s was %s",
+        interaction.user.name,
+        last_roll_str,
+        extra=interaction_fields(interaction),
+    )
     last_roll_time = (
         datetime.datetime.strptime(last_roll_str, "%Y-%m-%d %H:%M:%S.%f")
         if last_roll_str  # checks if last_roll_str has a value, else set date to 0 epoch
@@ -648,6 +1466,225 @@ async def pitroll(interaction: discord.Interaction):
     insert_roll(interaction.user.id, roll, timestamp)
 
 
+@app_commands.command()
+@app_commands.guild_only()
+@app_commands.describe(user="Who to check, defaults to you")
+async def pitstreak(interaction: discord.Interaction, user: Optional[discord.Member] = None):
+    """
+    Shows your pit roll streaks
+    """
+    target = user or interaction.user
+    streak = get_streak(target.id)
+    if streak is None:
+        await interaction.response.send_message(
+            f"{target.display_name} has never rolled <:Madge:786617980103688262>",
+            ephemeral=True,
+        )
+        return
+
+    days = live_day_streak(streak, datetime.date.today())
+    await interaction.response.send_message(
+        f"**{target.display_name}'s streaks**\n"
+        f"Days rolled in a row: {days} (best {streak.best_days})\n"
+        f"High rolls in a row: {streak.current_high} (best {streak.best_high})\n"
+        f"Low rolls in a row: {streak.current_low} (best {streak.best_low})",
+        ephemeral=True,
+    )
+
+
+def parse_date(date: Optional[str]) -> Optional[datetime.date]:
+    """
+    Parse a YYYY-MM-DD date given to a command
+
+    Args:
+        date (str, optional): The date as typed by the user
+
+    Raises:
+        ValueError: If the date isn't in YYYY-MM-DD format
+
+    Returns:
+        datetime.date or None: The parsed date or None if no date was given
+    """
+    if not date:
+        return None
+    return datetime.datetime.strptime(date, "%Y-%m-%d").date()
+
+
+async def moderation_denied(interaction: discord.Interaction) -> bool:
+    """
+    Turns away anyone who isn't allowed to moderate rolls
+
+    Args:
+        interaction (discord.Interaction): Discord interaction
+
+    Returns:
+        bool: If the user was turned away
+    """
+    if authorized(interaction, Capability.MOD | Capability.DEBUG):
+        return False
+    await interaction.response.send_message(
+        "<:Madge:786617980103688262> You just rolled a 1 BITCH", ephemeral=True
+    )
+    logger.info(
+        "%s tried to moderate rolls",
+        interaction.user.name,
+        extra=interaction_fields(interaction),
+    )
+    return True
+
+
+def roll_preview(rolls: list) -> str:
+    """
+    Lists the first few rolls for a dry run
+
+    Args:
+        rolls (list): (roll_id, user_id, roll, timestamp) rows
+
+    Returns:
+        str: One line per roll
+    """
+    lines = [f"<@{row.user_id}> rolled a {row.roll} at {row.timestamp}" for row in rolls[:10]]
+    if len(rolls) > 10:
+        lines.append(f"...and {len(rolls) - 10} more")
+    return "\n".join(lines)
+
+
+@app_commands.command()
+@app_commands.describe(user="Only rolls by this user")
+@app_commands.describe(start="Only rolls on or after this date (YYYY-MM-DD)")
+@app_commands.describe(end="Only rolls on or before this date (YYYY-MM-DD)")
+@app_commands.describe(roll="Only rolls of this value")
+@app_commands.describe(dry_run="Only show what would be voided. Defaults to true")
+async def pitvoid(
+    interaction: discord.Interaction,
+    user: Optional[discord.User] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    roll: Optional[app_commands.Range[int, 1, 12]] = None,
+    dry_run: bool = True,
+):
+    """
+    Voids every roll matching the filters
+    """
+    if await moderation_denied(interaction):
+        return
+    if user is None and start is None and end is None and roll is None:
+        await interaction.response.send_message(
+            "Give me at least one filter, I'm not touching every roll ever", ephemeral=True
+        )
+        return
+    try:
+        start_date = parse_date(start)
+        end_date = parse_date(end)
+    except ValueError:
+        await interaction.response.send_message(
+            "Dates need to be YYYY-MM-DD", ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    filters = dict(
+        user_id=user.id if user else None,
+        start=datetime.datetime.combine(start_date, datetime.time.min) if start_date else None,
+        end=datetime.datetime.combine(end_date, datetime.time.max) if end_date else None,
+        roll=roll,
+    )
+
+    if dry_run:
+        rolls = preview_void_rolls(**filters)
+        users = len({row.user_id for row in rolls})
+        await interaction.followup.send(
+            f"Dry run: would void {len(rolls)} rolls from {users} users\n" + roll_preview(rolls),
+            ephemeral=True,
+        )
+        return
+
+    if not user_exists(interaction.user.id):
+        add_user(interaction.user.id, interaction.user.name)
+    batch_id, removed = void_rolls(interaction.user.id, **filters)
+    users = len({row.user_id for row in removed})
+    logger.info(
+        "%s used pitvoid on %s rolls from %s users with %s, batch %s",
+        interaction.user.name,
+        len(removed),
+        users,
+        filters,
+        batch_id,
+        extra=interaction_fields(interaction),
+    )
+    if batch_id is None:
+        await interaction.followup.send("Nothing matched, no rolls voided", ephemeral=True)
+        return
+    await interaction.followup.send(
+        f"Voided {len(removed)} rolls from {users} users. Fucked it? `/pitunvoid batch:{batch_id}`",
+        ephemeral=True,
+    )
+
+
+@app_commands.command()
+@app_commands.describe(batch="The void to undo, leave empty to list your recent voids")
+@app_commands.describe(dry_run="Only show what would be restored. Defaults to true")
+async def pitunvoid(
+    interaction: discord.Interaction,
+    batch: Optional[int] = None,
+    dry_run: bool = True,
+):
+    """
+    Undoes one pitvoid, restoring exactly the rolls it voided
+    """
+    if await moderation_denied(interaction):
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    if batch is None:
+        batches = recent_void_batches(interaction.user.id)
+        if not batches:
+            await interaction.followup.send("You haven't voided anything you can undo", ephemeral=True)
+            return
+        lines = [
+            f"#{void.batch_id}: {void.roll_count} rolls at {void.voided_at:%Y-%m-%d %H:%M} ({void.filters})"
+            for void in batches
+        ]
+        await interaction.followup.send("Your recent voids:\n" + "\n".join(lines), ephemeral=True)
+        return
+
+    void = get_void_batch(batch)
+    # only the mod who voided the rolls gets to undo it, unless you're a debug user
+    if void is None or (
+        void.removed_by != interaction.user.id and not authorized(interaction, Capability.DEBUG)
+    ):
+        await interaction.followup.send(f"There's no void #{batch} of yours", ephemeral=True)
+        return
+    if void.restored_at is not None:
+        await interaction.followup.send(
+            f"Void #{batch} was already undone at {void.restored_at:%Y-%m-%d %H:%M}", ephemeral=True
+        )
+        return
+
+    if dry_run:
+        rolls = preview_restore_rolls(void)
+        users = len({row.user_id for row in rolls})
+        await interaction.followup.send(
+            f"Dry run: would restore {len(rolls)} rolls from {users} users\n" + roll_preview(rolls),
+            ephemeral=True,
+        )
+        return
+
+    restored = restore_rolls(void)
+    users = len({row.user_id for row in restored})
+    logger.info(
+        "%s used pitunvoid on batch %s, restored %s rolls from %s users",
+        interaction.user.name,
+        batch,
+        len(restored),
+        users,
+        extra=interaction_fields(interaction),
+    )
+    await interaction.followup.send(
+        f"Restored {len(restored)} rolls from {users} users", ephemeral=True
+    )
+
+
 class Months(Enum):
     """
     All the months of the year
@@ -668,7 +1705,7 @@ class Months(Enum):
 
 
 # @bot.slash_command(name="pitdata", description="Amy's command", on_application_command_error=on_application_command_error)
-@bot.tree.command()
+@app_commands.command()
 @app_commands.describe(month="Month to choose")
 @app_commands.describe(year="The year you want to get data for. Defaults to this year")
 async def pitdata(
@@ -679,17 +1716,19 @@ async def pitdata(
     """
     Amy's command
     """
-    if (interaction.user.id in data_users) or (
-        mod_roles in [role.id for role in interaction.user.roles]  # type: ignore
-    ):
+    if authorized(interaction, Capability.DATA | Capability.MOD):
         await interaction.response.defer(ephemeral=True, thinking=True)
         followup = interaction.followup
         # await interaction.respond("🤖 🖨️ for "+ month + " of " + str(year), ephemeral=True)
         # get index of chosen month
         months_rolls = get_rolls(month.value, year)
         double_months_rolls = get_double_rolls(month.value, year)
-        logging.info(
-            f"{interaction.user.display_name} used pitdata for {month} of {str(year)}"
+        logger.info(
+            "%s used pitdata for %s of %s",
+            interaction.user.display_name,
+            month,
+            year,
+            extra=interaction_fields(interaction),
         )
         # turn month_rolls object into csv
         with open("rolls.csv", "w") as csv_file:
@@ -709,9 +1748,46 @@ async def pitdata(
         await interaction.response.send_message(
             "<:Madge:786617980103688262> You just rolled a 1 BITCH"
         )
-        logging.info(
-            interaction.user.display_name
-            + " tried to use pitdata. Remind them that they a bitch NODDERS"
+        logger.info(
+            "%s tried to use pitdata. Remind them that they a bitch NODDERS",
+            interaction.user.display_name,
+            extra=interaction_fields(interaction),
+        )
+
+
+@app_commands.command()
+@app_commands.describe(user="Only look at this user's rolls")
+@app_commands.describe(months="Number of months to show in the trend")
+async def pitstats(
+    interaction: discord.Interaction,
+    user: Optional[discord.User] = None,
+    months: app_commands.Range[int, 1, 24] = 6,
+):
+    """
+    Is the pit rigged?
+    """
+    if authorized(interaction, Capability.DATA | Capability.MOD):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        start_time = time.time()
+        snapshot = refresh_roll_snapshot()
+        report = fairness_report(
+            snapshot, user.id if user else None, months, usernames=get_usernames()
+        )
+        logger.info(
+            "%s used pitstats on %s rolls",
+            interaction.user.display_name,
+            snapshot.rows,
+            extra=interaction_fields(interaction, latency=time.time() - start_time),
+        )
+        await interaction.followup.send(f"```\n{report[:1900]}\n```", ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            "<:Madge:786617980103688262> You just rolled a 1 BITCH"
+        )
+        logger.info(
+            "%s tried to use pitstats. Remind them that they a bitch NODDERS",
+            interaction.user.display_name,
+            extra=interaction_fields(interaction),
         )
 
 
@@ -727,14 +1803,8 @@ async def pitdata(
 #         await interaction.respond("🖨 📰")
 #         followup = interaction.followup
 #         messages = [message async for message in interaction.channel.history(limit=num_messages)]
-#         extracted = []
-#         for message in messages:
-#             if message.author.id in bots:
-#                 continue
-#             extracted.append(
-#                 f'{message.author.display_name} : {message.content} \n')
-#         extracted.reverse()
-#         text = ''.join(str(value) for value in extracted)
+#         text, report = build_transcript(reversed(messages), bots, transcript_rules)
+#         logger.info("Newspaper transcript: %s", report, extra=interaction_fields(interaction))
 #         summary = await generate_summ(text)
 #         time_taken = str(time.time() - start_time)
 #         logging.info(interaction.user.display_name + " generated a newspaper with a length of " + str(len(summary)) + " in " + time_taken + " seconds")
@@ -749,47 +1819,129 @@ async def pitdata(
 
 
 # @bot.slash_command(name="debug", description="Debugging command")
-@bot.tree.command()
-@app_commands.describe(bozo_points="fuck")
-async def debug(interaction: discord.Interaction, bozo_points: int = 500):
+@app_commands.command()
+@app_commands.describe(bozo_points="fuck", raw="Keep the shitposts in")
+async def debug(interaction: discord.Interaction, bozo_points: int = 500, raw: bool = False):
     """
     Admin fuckery
     """
-    if interaction.user.id in debug_users:
+    if authorized(interaction, Capability.DEBUG):
         await interaction.response.defer(ephemeral=True, thinking=True)
         followup = interaction.followup
         messages = [
             message async for message in interaction.channel.history(limit=bozo_points)  # type: ignore
         ]
-        extracted = []
-        for message in messages:
-            if message.author.id in bots:
-                continue
-            extracted.append(f"{message.author.display_name} : {message.content} \n")
-        extracted.reverse()
-        text = "".join(str(value) for value in extracted)
+        # history comes newest first
+        text, report = build_transcript(
+            reversed(messages), bots, NO_FILTER if raw else transcript_rules
+        )
+        logger.info("Debug transcript: %s", report, extra=interaction_fields(interaction))
         with open("debug.txt", "w") as f:
             f.write(text)
         await followup.send(
-            "Here you go:", file=discord.File("debug.txt"), ephemeral=True
+            f"Here you go: {report}", file=discord.File("debug.txt"), ephemeral=True
+        )
+    else:
+        logger.info(
+            "%s tried to use the debug command, This incident has been reported",
+            interaction.user.name,
+            extra=interaction_fields(interaction),
+        )
+        await interaction.response.send_message(
+            f"{interaction.user.name} is not in the sudoers file.  This incident will be reported.",
+            ephemeral=True,
+        )
+
+
+@app_commands.command()
+async def pitstreakrebuild(interaction: discord.Interaction):
+    """
+    Rebuilds everyone's streaks from the roll history
+    """
+    if authorized(interaction, Capability.DEBUG):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        start_time = time.time()
+        users = rebuild_streaks()
+        logger.info(
+            "%s rebuilt streaks for %s users",
+            interaction.user.name,
+            users,
+            extra=interaction_fields(interaction, latency=time.time() - start_time),
+        )
+        await interaction.followup.send(
+            f"Rebuilt streaks for {users} users", ephemeral=True
+        )
+    else:
+        await interaction.response.send_message(
+            f"{interaction.user.name} is not in the sudoers file.  This incident will be reported.",
+            ephemeral=True,
+        )
+
+
+@app_commands.command()
+@app_commands.describe(keep_months="Months to keep in the live tables, counting this month")
+async def pitarchive(interaction: discord.Interaction, keep_months: app_commands.Range[int, 1, 120] = 1):
+    """
+    Moves old months of rolls into archive tables
+    """
+    if authorized(interaction, Capability.DEBUG):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        start_time = time.time()
+        archived = archive_rolls(keep_months)
+        logger.info(
+            "%s archived %s months",
+            interaction.user.name,
+            len(archived),
+            extra=interaction_fields(interaction, latency=time.time() - start_time),
+        )
+        lines = [
+            f"{year}-{month:02d}: {rolls} rolls, {doublerolls} doublerolls"
+            for year, month, rolls, doublerolls in archived
+        ]
+        await interaction.followup.send(
+            f"Archived {len(archived)} months\n" + "\n".join(lines), ephemeral=True
         )
     else:
-        logging.info(
-            f"{interaction.user.name} tried to use the debug command, This incident has been reported"
+        await interaction.response.send_message(
+            f"{interaction.user.name} is not in the sudoers file.  This incident will be reported.",
+            ephemeral=True,
+        )
+
+
+@app_commands.command()
+async def pitsnapshot(interaction: discord.Interaction):
+    """
+    Brings the roll history snapshot up to date
+    """
+    if authorized(interaction, Capability.DEBUG):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        start_time = time.time()
+        snapshot = refresh_roll_snapshot()
+        time_taken = round(time.time() - start_time, 2)
+        logger.info(
+            "%s refreshed the roll snapshot to %s rolls",
+            interaction.user.name,
+            snapshot.rows,
+            extra=interaction_fields(interaction, latency=time_taken),
+        )
+        await interaction.followup.send(
+            f"Snapshot has {snapshot.rows} rolls up to roll {snapshot.high_water_mark}, took {time_taken} seconds",
+            ephemeral=True,
         )
+    else:
         await interaction.response.send_message(
             f"{interaction.user.name} is not in the sudoers file.  This incident will be reported.",
             ephemeral=True,
         )
 
 
-@bot.tree.command()
+@app_commands.command()
 async def rollfordeath(interaction: discord.Interaction):
     """
     Rolls for perma
     """
     # check if user is debug user
-    if interaction.user.id in debug_users:
+    if authorized(interaction, Capability.DEBUG):
         await interaction.response.defer()
         followup = interaction.followup
         random.seed()
@@ -798,8 +1950,11 @@ async def rollfordeath(interaction: discord.Interaction):
             await followup.send(f"{interaction.user.display_name} rolled a 1, HE LIVES")
         else:
             await followup.send(f"{interaction.user.display_name} rolled a 2, HE DEAD")
-        logging.info(
-            f"{interaction.user.display_name} rolled a {roll}, 1 is live, 2 is dead"
+        logger.info(
+            "%s rolled a %s, 1 is live, 2 is dead",
+            interaction.user.display_name,
+            roll,
+            extra=interaction_fields(interaction),
         )
     else:
         await interaction.response.send_message(
@@ -817,4 +1972,100 @@ async def rollfordeath(interaction: discord.Interaction):
 #         await interaction.response.send_message(f"{interaction.user.display_name} is not in the sudoers file.  This incident will be reported.", ephemeral=True)
 
 
-bot.run(TOKEN)
+# Startup
+#region
+def build_client() -> None:
+    """
+    Startup phase: builds the client and registers every command and event handler on it
+    """
+    global bot, recent_members
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+
+    recent_members = RecentMembers(member_cache.recent_size, on_evict=permission_index.forget_member)
+    bot = MyClient(intents=intents)
+
+    for handler in (
+        on_ready,
+        on_member_update,
+        on_raw_member_remove,
+        on_guild_role_update,
+        on_guild_role_delete,
+        on_app_command_completion,
+    ):
+        bot.event(handler)
+    bot.tree.error(on_app_command_error)
+    for command in (
+        ping,
+        convertnikez,
+        pitroll,
+        pitstreak,
+        pitvoid,
+        pitunvoid,
+        pitdata,
+        pitstats,
+        debug,
+        pitstreakrebuild,
+        pitarchive,
+        pitsnapshot,
+        rollfordeath,
+    ):
+        bot.tree.add_command(command)
+
+
+async def sync_commands() -> None:
+    """
+    Startup phase: pushes the slash commands to Discord
+    """
+    # This copies the global commands over to your guild.
+    if DEV:
+        bot.tree.copy_global_to(guild=MY_GUILD)  # type: ignore
+        await bot.tree.sync(guild=MY_GUILD)
+        # bot.tree.copy_global_to(guild=TEST_GUILD)
+        # await bot.tree.sync(guild=TEST_GUILD)
+        logger.info("Copied global commands to dev guilds")
+    else:
+        await bot.tree.sync()
+
+
+def prepare() -> None:
+    """
+    Runs the startup phases that don't talk to Discord. Importing this module doesn't do any of this,
+    so tools and tests can run just what they need
+    """
+    with startup_timer.phase("config"):
+        load_config()
+    with startup_timer.phase("database"):
+        connect_database()
+    with startup_timer.phase("client build"):
+        build_client()
+
+
+async def run_bot() -> None:
+    """
+    Runs the startup phases that talk to Discord, then stays connected until the bot is stopped
+    """
+    async with bot:
+        with startup_timer.phase("gateway login"):
+            await bot.login(TOKEN)
+        with startup_timer.phase("command sync"):
+            await sync_commands()
+        # finished by on_ready
+        startup_timer.begin("gateway ready")
+        await bot.connect()
+
+
+def main() -> None:
+    prepare()
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        # same as bot.run, ctrl+c is how this thing gets turned off
+        pass
+#endregion
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import atexit
+import datetime
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# extra fields pulled out of log records into the JSON output
+STRUCTURED_FIELDS = ("command", "user", "guild", "latency")
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line, including any structured fields passed through extra
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves the record alone, so message formatting happens on the writer thread
+    instead of on the event loop
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: int = logging.INFO, json_logs: bool = False) -> QueueListener:
+    """
+    Routes every log record through a queue to a background thread that formats and writes it
+
+    Args:
+        level (int): Lowest level to log
+        json_logs (bool): Write JSON lines instead of plain text
+
+    Returns:
+        QueueListener: The running background writer, stopped automatically on exit
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_logs else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def interaction_fields(interaction, latency: Optional[float] = None) -> dict:
+    """
+    Builds the structured fields for a log line about an interaction, pass the result as extra
+
+    Args:
+        interaction (discord.Interaction): Discord interaction
+        latency (float, optional): Seconds the interaction took
+
+    Returns:
+        dict: command, user, guild and latency fields
+    """
+    command = getattr(interaction, "command", None)
+    fields = {
+        "command": command.qualified_name if command else None,
+        "user": interaction.user.id,
+        "guild": interaction.guild_id,
+    }
+    if latency is not None:
+        fields["latency"] = round(latency, 4)
+    return fields
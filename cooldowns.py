@@ -0,0 +1,297 @@
+import abc
+import asyncio
+import heapq
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import discord
+from discord import app_commands
+import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from models import Cooldowns
+
+# databases that can take a token in a single INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def refill(tokens: float, updated_at: float, rate: int, per: float, now: float) -> float:
+    """
+    Works out how many tokens a bucket has after refilling since it was last updated
+
+    Args:
+        tokens (float): Tokens left at the last update
+        updated_at (float): Unix time of the last update
+        rate (int): Maximum number of uses per window
+        per (float): Length of the window in seconds
+        now (float): Current unix time
+
+    Returns:
+        float: Tokens available now, capped at rate
+    """
+    return min(float(rate), tokens + (now - updated_at) * rate / per)
+
+
+def take_token(tokens: float, rate: int, per: float, now: float) -> Tuple[float, float, float]:
+    """
+    Tries to take a token out of a bucket that has already been refilled
+
+    Args:
+        tokens (float): Tokens available now
+        rate (int): Maximum number of uses per window
+        per (float): Length of the window in seconds
+        now (float): Current unix time
+
+    Returns:
+        Tuple[float, float, float]: Tokens left, seconds until the next token if none could be taken (0 otherwise)
+        and the unix time the bucket is full again
+    """
+    retry_after = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        retry_after = (1 - tokens) * per / rate
+    expires_at = now + (rate - tokens) * per / rate
+    return tokens, retry_after, expires_at
+
+
+class CooldownStore(abc.ABC):
+    """
+    Base class for token bucket cooldown storage.
+    A missing bucket is treated as a full one, so expired buckets can be thrown away in batches
+
+    Args:
+        cleanup_every (int): Number of checks between expired bucket cleanups
+    """
+
+    # checks against stores that do I/O are run in a thread instead of on the event loop
+    blocking = False
+
+    def __init__(self, cleanup_every: int = 256):
+        self.cleanup_every = cleanup_every
+        self._checks = 0
+
+    def update_rate_limit(
+        self, key: str, rate: int, per: float, now: Optional[float] = None
+    ) -> float:
+        """
+        Takes a token from the bucket for key
+
+        Args:
+            key (str): The bucket to take a token from
+            rate (int): Maximum number of uses per window
+            per (float): Length of the window in seconds
+            now (float, optional): Current unix time, defaults to time.time()
+
+        Returns:
+            float: Seconds until the bucket has a token, 0 if a token was taken
+        """
+        now = time.time() if now is None else now
+        retry_after = self._take(key, rate, per, now)
+        self._checks += 1
+        if self._checks >= self.cleanup_every:
+            self._checks = 0
+            self.cleanup(now)
+        return retry_after
+
+    @abc.abstractmethod
+    def _take(self, key: str, rate: int, per: float, now: float) -> float:
+        """
+        Refills the bucket for key and takes a token from it if there is one
+
+        Args:
+            key (str): The bucket to take a token from
+            rate (int): Maximum number of uses per window
+            per (float): Length of the window in seconds
+            now (float): Current unix time
+
+        Returns:
+            float: Seconds until the bucket has a token, 0 if a token was taken
+        """
+
+    @abc.abstractmethod
+    def reset(self, key: str) -> None:
+        """
+        Refills the bucket for key
+
+        Args:
+            key (str): The bucket to refill
+        """
+
+    @abc.abstractmethod
+    def cleanup(self, now: Optional[float] = None) -> int:
+        """
+        Throws away every bucket that has fully refilled
+
+        Args:
+            now (float, optional): Current unix time, defaults to time.time()
+
+        Returns:
+            int: Number of buckets thrown away
+        """
+
+
+class MemoryCooldownStore(CooldownStore):
+    """
+    Keeps the buckets in process memory. Fast, but forgotten on restart and not shared between processes
+    """
+
+    def __init__(self, cleanup_every: int = 256):
+        super().__init__(cleanup_every)
+        # key: (tokens, updated_at, expires_at)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._expiry: List[Tuple[float, str]] = []
+
+    def _take(self, key: str, rate: int, per: float, now: float) -> float:
+        bucket = self._buckets.get(key)
+        tokens = refill(bucket[0], bucket[1], rate, per, now) if bucket else float(rate)
+        tokens, retry_after, expires_at = take_token(tokens, rate, per, now)
+        self._buckets[key] = (tokens, now, expires_at)
+        heapq.heappush(self._expiry, (expires_at, key))
+        return retry_after
+
+    def reset(self, key: str) -> None:
+        self._buckets.pop(key, None)
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            bucket = self._buckets.get(key)
+            # the heap keeps stale entries for buckets that have been used again since
+            if bucket and bucket[2] == expires_at:
+                del self._buckets[key]
+                removed += 1
+        return removed
+
+
+class SQLCooldownStore(CooldownStore):
+    """
+    Keeps the buckets in the cooldowns table so they survive restarts and are shared
+    between every process pointed at the same database
+
+    Args:
+        session_factory (sessionmaker): Session factory bound to the database holding the cooldowns table
+        cleanup_every (int): Number of checks between expired bucket cleanups
+    """
+
+    blocking = True
+
+    def __init__(self, session_factory: sessionmaker, cleanup_every: int = 256):
+        super().__init__(cleanup_every)
+        self.session_factory = session_factory
+
+    def _take(self, key: str, rate: int, per: float, now: float) -> float:
+        with self.session_factory() as session:
+            dialect = session.get_bind().dialect.name
+            if dialect in UPSERT_DIALECTS:
+                tokens, updated_at = self._upsert(session, UPSERT_DIALECTS[dialect], key, rate, per, now)
+            else:
+                tokens, updated_at = self._take_locked(session, key, rate, per, now)
+            session.commit()
+        if updated_at == now:
+            return 0.0
+        # no token was taken and the bucket was left alone, work out when the next one turns up
+        return (1 - refill(tokens, updated_at, rate, per, now)) * per / rate
+
+    @staticmethod
+    def _upsert(session, insert, key: str, rate: int, per: float, now: float) -> Tuple[float, float]:
+        # the whole check is one statement, so processes racing on the same bucket are serialised by the database.
+        # A denied check leaves the row as it was, so updated_at only moves when a token is taken
+        fill_rate = rate / per
+        stored = Cooldowns.tokens + (now - Cooldowns.updated_at) * fill_rate
+        refilled = sqlalchemy.case((stored >= rate, float(rate)), else_=stored)
+        taken = refilled >= 1
+        statement = (
+            insert(Cooldowns)
+            .values(key=key, tokens=rate - 1.0, updated_at=now, expires_at=now + 1 / fill_rate)
+            .on_conflict_do_update(
+                index_elements=[Cooldowns.key],
+                set_={
+                    "tokens": sqlalchemy.case((taken, refilled - 1), else_=Cooldowns.tokens),
+                    "updated_at": sqlalchemy.case((taken, now), else_=Cooldowns.updated_at),
+                    "expires_at": sqlalchemy.case(
+                        (taken, now + (rate - (refilled - 1)) / fill_rate), else_=Cooldowns.expires_at
+                    ),
+                },
+            )
+            .returning(Cooldowns.tokens, Cooldowns.updated_at)
+        )
+        tokens, updated_at = session.execute(statement).one()
+        return tokens, updated_at
+
+    @staticmethod
+    def _take_locked(session, key: str, rate: int, per: float, now: float) -> Tuple[float, float]:
+        # databases without an upsert lock the row instead
+        bucket = session.get(Cooldowns, key, with_for_update=True)
+        if bucket is None:
+            try:
+                with session.begin_nested():
+                    session.add(Cooldowns(key=key, tokens=float(rate), updated_at=now, expires_at=now))
+            except IntegrityError:
+                # another process made the bucket first, use theirs
+                pass
+            bucket = session.get(Cooldowns, key, with_for_update=True, populate_existing=True)
+        tokens = refill(bucket.tokens, bucket.updated_at, rate, per, now)
+        if tokens < 1:
+            return bucket.tokens, bucket.updated_at
+        bucket.tokens, _, bucket.expires_at = take_token(tokens, rate, per, now)
+        bucket.updated_at = now
+        return bucket.tokens, now
+
+    def reset(self, key: str) -> None:
+        with self.session_factory() as session:
+            session.query(Cooldowns).filter(Cooldowns.key == key).delete()
+            session.commit()
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self.session_factory() as session:
+            removed = (
+                session.query(Cooldowns)
+                .filter(Cooldowns.expires_at <= now)
+                .delete(synchronize_session=False)
+            )
+            session.commit()
+        return removed
+
+
+def shared_cooldown(
+    store: Union[CooldownStore, Callable[[], CooldownStore]],
+    factory: Callable[[discord.Interaction], Optional[app_commands.Cooldown]],
+):
+    """
+    Drop in replacement for app_commands.checks.dynamic_cooldown that keeps its buckets in a CooldownStore.
+    Each command gets its own bucket per user, same as dynamic_cooldown
+
+    Args:
+        store (Union[CooldownStore, Callable[[], CooldownStore]]): Where the buckets are kept, or a function
+        returning it for stores that are only picked once the bot starts
+        factory (Callable[[discord.Interaction], Optional[app_commands.Cooldown]]): Returns the cooldown to apply,
+        or None to skip the cooldown
+
+    Raises:
+        app_commands.CommandOnCooldown: If the user has no tokens left
+    """
+
+    async def predicate(interaction: discord.Interaction) -> bool:
+        cooldown = factory(interaction)
+        if cooldown is None:
+            return True
+        key = f"{interaction.command.qualified_name}:{interaction.user.id}"  # type: ignore
+        active_store = store() if callable(store) else store
+        if active_store.blocking:
+            # a database round trip, keep it off the event loop so everyone else's commands carry on
+            retry_after = await asyncio.get_running_loop().run_in_executor(
+                None, active_store.update_rate_limit, key, cooldown.rate, cooldown.per
+            )
+        else:
+            retry_after = active_store.update_rate_limit(key, cooldown.rate, cooldown.per)
+        if retry_after:
+            raise app_commands.CommandOnCooldown(cooldown, retry_after)
+        return True
+
+    return app_commands.check(predicate)
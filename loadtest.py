@@ -0,0 +1,275 @@
+#!/bin/python3
+"""
+Load test for the slash commands.
+Drives the real command callbacks with fake interactions against a local database
+and reports throughput, latency and how long each interaction took to be acknowledged.
+
+Run `python loadtest.py --help` for options
+"""
+
+import argparse
+import asyncio
+import datetime
+import math
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import discord
+from discord import app_commands
+
+# Discord drops interactions that haven't been acknowledged within this many seconds
+ACK_DEADLINE = 3.0
+
+COMMANDS = ["pitroll", "pitdata", "convertnikez", "debug"]
+
+
+class FakeMessage:
+    def __init__(self, api_latency: float, author=None, content: str = ""):
+        self.api_latency = api_latency
+        self.author = author
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        await asyncio.sleep(self.api_latency)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    def _acknowledge(self):
+        if self._done:
+            raise discord.errors.InteractionResponded(self.interaction)  # type: ignore
+        self._done = True
+        self.interaction.acknowledged_at = time.perf_counter()
+
+    async def defer(self, **kwargs):
+        self._acknowledge()
+        await asyncio.sleep(self.interaction.api_latency)
+
+    async def send_message(self, content=None, **kwargs):
+        self._acknowledge()
+        await asyncio.sleep(self.interaction.api_latency)
+
+
+class FakeFollowup:
+    def __init__(self, api_latency: float):
+        self.api_latency = api_latency
+
+    async def send(self, content=None, *, file=None, files=None, **kwargs):
+        for attachment in ([file] if file else []) + (files or []):
+            attachment.close()
+        await asyncio.sleep(self.api_latency)
+        return FakeMessage(self.api_latency)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, api_latency: float, authors: List["FakeMember"]):
+        self.id = channel_id
+        self.name = "the-pit"
+        self.api_latency = api_latency
+        self.authors = authors
+
+    async def history(self, limit: int = 100):
+        await asyncio.sleep(self.api_latency)
+        for i in range(limit):
+            author = self.authors[i % len(self.authors)]
+            yield FakeMessage(self.api_latency, author, f"message {i} from {author.name}")
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeMember:
+    def __init__(self, user_id: int, guild: FakeGuild, roles: List[FakeRole]):
+        self.id = user_id
+        self.name = f"loadtest{user_id}"
+        self.display_name = self.name
+        self.guild = guild
+        self.roles = roles
+        self.bot = False
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeMember, channel: FakeChannel, command, api_latency: float):
+        self.user = user
+        self.channel = channel
+        self.guild = user.guild
+        self.guild_id = user.guild.id
+        self.command = command
+        self.api_latency = api_latency
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(api_latency)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.acknowledged_at: Optional[float] = None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest rank percentile
+
+    Args:
+        values (List[float]): The values, in any order
+        q (float): Percentile to get (0-100)
+
+    Returns:
+        float: The percentile, 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def invoke(
+    app,
+    name: str,
+    user: FakeMember,
+    channel: FakeChannel,
+    api_latency: float,
+    arrived: float,
+    results: Dict[str, dict],
+):
+    """
+    Runs one command the way the command tree does, global check, command checks then the callback,
+    and records how it went.
+    Times are measured from when the interaction arrived, so time spent waiting on a blocked event loop counts
+
+    Args:
+        app (module): The bot module
+        name (str): Name of the command to run
+        user (FakeMember): Who is running the command
+        channel (FakeChannel): Where the command is run
+        api_latency (float): Seconds each fake Discord API call takes
+        arrived (float): perf_counter time the interaction arrived
+        results (Dict[str, dict]): Where to record the result
+    """
+    command = getattr(app, name)
+    interaction = FakeInteraction(user, channel, command, api_latency)
+    kwargs = {
+        "pitroll": {},
+        "pitdata": {"month": app.Months(datetime.date.today().month), "year": datetime.date.today().year},
+        "convertnikez": {"num": random.uniform(1, 100), "unit": random.choice(list(app.Units))},
+        "debug": {"bozo_points": 100},
+    }[name]
+
+    result = results[name]
+    try:
+        # the checks run before the command can defer, so they count towards the time to acknowledge
+        if await app.bot.tree.interaction_check(interaction) and await command._check_can_run(interaction):
+            await command.callback(interaction, **kwargs)
+    except app_commands.CommandOnCooldown as e:
+        # a cooldown is a normal answer, the error handler tells the user to wait
+        result["cooldowns"] += 1
+        await app.on_app_command_error(interaction, e)
+    except Exception as e:
+        result["errors"] += 1
+        result["last_error"] = repr(e)
+    end = time.perf_counter()
+    result["latency"].append(end - arrived)
+    if interaction.acknowledged_at is not None:
+        result["ack"].append(interaction.acknowledged_at - arrived)
+
+
+async def run(app, users: int, rounds: int, commands: List[str], api_latency: float) -> float:
+    """
+    Runs every fake user at once, each running every command rounds times
+
+    Returns:
+        float: Wall clock seconds the run took
+    """
+    guild = FakeGuild(1)
+    roles = [FakeRole(app.sub_role)] + [FakeRole(role) for role in app.mod_roles]
+    members = [FakeMember(900000000000000000 + i, guild, roles) for i in range(users)]
+    # the debug command is gated on user IDs, let the fake users through.
+    # Debug users skip cooldowns too, so only do it when debug is being run
+    if "debug" in commands:
+        print("debug is being run, so every fake user skips cooldowns")
+        for member in members:
+            app.permission_index.user_capabilities[member.id] = app.Capability.DEBUG
+    channel = FakeChannel(app.pit, api_latency, members)
+
+    results = {
+        name: {"latency": [], "ack": [], "errors": 0, "cooldowns": 0, "last_error": None} for name in commands
+    }
+
+    start = time.perf_counter()
+
+    async def user_session(member: FakeMember):
+        # everyone's first command lands at the same moment, like the midnight reset
+        arrived = start
+        for _ in range(rounds):
+            for name in commands:
+                await invoke(app, name, member, channel, api_latency, arrived, results)
+                arrived = time.perf_counter()
+
+    await asyncio.gather(*(user_session(member) for member in members))
+    wall = time.perf_counter() - start
+
+    print(f"{users} users x {rounds} rounds, {api_latency * 1000:.0f}ms fake API latency, {wall:.2f}s wall clock")
+    print(
+        f"{'command':<14}{'calls':>7}{'errors':>8}{'cooldown':>9}{'calls/s':>9}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'ack p50':>9}{'ack p99':>9}{'>3s ack':>9}"
+    )
+    for name, result in results.items():
+        calls = len(result["latency"])
+        late = sum(1 for ack in result["ack"] if ack > ACK_DEADLINE) + (calls - len(result["ack"]))
+        print(
+            f"{name:<14}{calls:>7}{result['errors']:>8}{result['cooldowns']:>9}{calls / wall:>9.1f}"
+            f"{percentile(result['latency'], 50) * 1000:>9.1f}{percentile(result['latency'], 99) * 1000:>9.1f}"
+            f"{percentile(result['ack'], 50) * 1000:>9.1f}{percentile(result['ack'], 99) * 1000:>9.1f}{late:>9}"
+        )
+        if result["last_error"]:
+            print(f"  last error: {result['last_error']}")
+    return wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer the slash commands with fake interactions")
+    parser.add_argument("--users", type=int, default=50, help="Number of users running commands at the same time")
+    parser.add_argument("--rounds", type=int, default=1, help="Number of times each user runs each command")
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS, default=["pitroll"], help="Commands to run")
+    parser.add_argument("--api-latency", type=float, default=50, help="Milliseconds each fake Discord API call takes")
+    parser.add_argument("--database", help="Database URL, defaults to a fresh SQLite file")
+    parser.add_argument(
+        "--cooldown-store", choices=["sql", "memory"], default="sql", help="Where cooldowns are kept, sql like production"
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest")
+    # has to be set up before the startup phases run, they read these
+    os.environ.setdefault("TOKEN", "loadtest")
+    os.environ["DEV"] = "false"
+    os.environ["DATABASEURL"] = args.database or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    # load_dotenv fills in anything not set here, so a replica in .env would otherwise serve the reads
+    os.environ["READ_DATABASEURL"] = os.environ["DATABASEURL"]
+    os.environ["COOLDOWN_STORE"] = args.cooldown_store
+    os.environ["SNAPSHOT_PATH"] = os.path.join(workdir, "snapshot")
+    import app
+
+    # everything except logging in to Discord
+    app.prepare()
+    print(f"Startup: {app.startup_timer.report()}")
+    # pitdata and debug write their files to the working directory
+    os.chdir(workdir)
+    print(f"Database: {os.environ['DATABASEURL']}")
+    asyncio.run(run(app, args.users, args.rounds, args.commands, args.api_latency / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import resource
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+import discord
+
+POLICIES = ("recent", "all")
+
+
+class MemberCachePolicy(NamedTuple):
+    """
+    How much of each guild's member list the bot keeps in memory
+
+    Args:
+        name (str): "recent" keeps only members who used the bot lately, "all" keeps everyone
+        flags (discord.MemberCacheFlags): What discord.py caches by itself
+        chunk_guilds_at_startup (bool): Download every member of every guild before on_ready
+        recent_size (int): Most members kept in the recently active cache
+    """
+
+    name: str
+    flags: discord.MemberCacheFlags
+    chunk_guilds_at_startup: bool
+    recent_size: int
+
+    @property
+    def caches_everyone(self) -> bool:
+        return self.name == "all"
+
+
+def member_cache_policy(
+    name: str = "recent", recent_size: int = 1000, chunk_guilds_at_startup: Optional[bool] = None
+) -> MemberCachePolicy:
+    """
+    Builds a member cache policy
+
+    Args:
+        name (str): "recent" or "all"
+        recent_size (int): Most members kept in the recently active cache, at least 1 for "recent"
+        chunk_guilds_at_startup (bool, optional): Override for chunking, defaults to chunking only when caching everyone
+
+    Returns:
+        MemberCachePolicy: The policy
+
+    Raises:
+        ValueError: If the policy name isn't known, or "recent" is asked to keep nobody
+    """
+    name = name.lower()
+    if name not in POLICIES:
+        raise ValueError(f"Unknown member cache policy {name!r}, use one of {', '.join(POLICIES)}")
+    # the recent cache is what bounds the permission index, with room for nobody it couldn't evict anyone
+    if name == "recent" and recent_size < 1:
+        raise ValueError(f"The recent member cache needs room for at least 1 member, got {recent_size}")
+    if name == "all":
+        flags = discord.MemberCacheFlags.all()
+    else:
+        # interactions carry the invoking member and their roles, so nothing else needs to be cached
+        flags = discord.MemberCacheFlags.none()
+    if chunk_guilds_at_startup is None:
+        chunk_guilds_at_startup = name == "all"
+    return MemberCachePolicy(name, flags, chunk_guilds_at_startup, max(recent_size, 0))
+
+
+class RecentMembers:
+    """
+    Bounded least recently used set of the members who have used the bot lately.
+    Only the IDs are kept, the member objects come with every interaction
+
+    Args:
+        maxsize (int): Most members to keep, 0 keeps none and evicts everyone straight away
+        on_evict (Callable[[Optional[int], int], None], optional): Called with the guild ID and user ID of anyone pushed out
+    """
+
+    def __init__(self, maxsize: int, on_evict: Optional[Callable[[Optional[int], int], None]] = None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        # (guild id, user id), oldest first
+        self._members: "OrderedDict[Tuple[Optional[int], int], None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def add(self, member: Union[discord.Member, discord.User]) -> None:
+        """
+        Marks a member as recently active, pushing out the least recently active if full
+
+        Args:
+            member (Union[discord.Member, discord.User]): The member
+        """
+        guild = getattr(member, "guild", None)
+        key = (guild.id if guild else None, member.id)
+        if self.maxsize <= 0:
+            if self.on_evict:
+                self.on_evict(*key)
+            return
+        self._members[key] = None
+        self._members.move_to_end(key)
+        while len(self._members) > self.maxsize:
+            (guild_id, user_id), _ = self._members.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(guild_id, user_id)
+
+    def discard(self, guild_id: Optional[int], user_id: int) -> None:
+        """
+        Forgets a member
+
+        Args:
+            guild_id (Optional[int]): Guild the member was in, None for DMs
+            user_id (int): Discord User ID
+        """
+        self._members.pop((guild_id, user_id), None)
+
+
+def cache_report(client: discord.Client, policy: MemberCachePolicy, recent: RecentMembers) -> str:
+    """
+    Describes how much is cached, for logging once the bot is ready
+
+    Args:
+        client (discord.Client): The connected client
+        policy (MemberCachePolicy): The member cache policy in use
+        recent (RecentMembers): The recently active members cache
+
+    Returns:
+        str: The report
+    """
+    cached_members = sum(len(guild.members) for guild in client.guilds)
+    total_members = sum(guild.member_count or 0 for guild in client.guilds)
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return (
+        f"member cache policy {policy.name} (chunking {'on' if policy.chunk_guilds_at_startup else 'off'}): "
+        f"{len(client.guilds)} guilds, {cached_members}/{total_members} members cached, "
+        f"{len(client.users)} users cached, {len(recent)}/{recent.maxsize} recently active, "
+        f"peak RSS {peak_rss:.0f} MiB"
+    )
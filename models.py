@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Date, Boolean, ForeignKey, BigInteger, Float, MetaData, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
 Base = declarative_base()
 
+# archive tables are created per month on demand, so they aren't part of Base.metadata
+archive_metadata = MetaData()
+
 # Classes
 class User(Base):
     """
@@ -49,6 +52,8 @@ class Rolls(Base):
         _type_: _description_
     """    
     __tablename__ = "rolls"
+    # never hand out an ID again once its row has been archived, Postgres sequences already behave like this
+    __table_args__ = {"sqlite_autoincrement": True}
     roll_id = Column(Integer, primary_key=True)  # Correct the primary key name
     user_id = Column(BigInteger, ForeignKey('users.userid'), nullable=False)
     roll = Column(Integer, nullable=False)
@@ -80,6 +85,7 @@ class DoubleRolls(Base):
         _type_: _description_
     """    
     __tablename__ = "doublerolls"
+    __table_args__ = {"sqlite_autoincrement": True}
     doubleroll_id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, ForeignKey('users.userid'), nullable=False)
     timestamp = Column(DateTime, default=datetime.now)
@@ -90,3 +96,207 @@ class DoubleRolls(Base):
 
     def __repr__(self):
         return f"<DoubleRolls(doubleroll_id={self.doubleroll_id}, user_id={self.user_id}, roll={self.roll}, timestamp={self.timestamp}>"
+
+
+class Streaks(Base):
+    """
+    Model for the streaks table
+    This table keeps each user's current and best streaks so they can be read
+    without going through the whole rolls table
+
+    Args:
+        Base (Base): Declared base from SQLAlchemy
+        user_id (BigInteger): Primary key and foreign key to the users table
+        last_roll_date (Date): Date of the last roll counted towards the streaks
+        current_days (Integer): Number of consecutive days rolled, ending on last_roll_date
+        best_days (Integer): Longest run of consecutive days rolled
+        current_high (Integer): Number of consecutive high rolls, ending on the last roll
+        best_high (Integer): Longest run of consecutive high rolls
+        current_low (Integer): Number of consecutive low rolls, ending on the last roll
+        best_low (Integer): Longest run of consecutive low rolls
+
+    Returns:
+        Streaks: SQLAlchemy model for the streaks table
+    """
+    __tablename__ = "streaks"
+    user_id = Column(BigInteger, ForeignKey('users.userid'), primary_key=True)
+    last_roll_date = Column(Date, default=None, nullable=True)
+    current_days = Column(Integer, default=0, nullable=False)
+    best_days = Column(Integer, default=0, nullable=False)
+    current_high = Column(Integer, default=0, nullable=False)
+    best_high = Column(Integer, default=0, nullable=False)
+    current_low = Column(Integer, default=0, nullable=False)
+    best_low = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<Streaks(user_id={self.user_id}, last_roll_date={self.last_roll_date}, days={self.current_days}/{self.best_days}, high={self.current_high}/{self.best_high}, low={self.current_low}/{self.best_low})>"
+
+
+class Cooldowns(Base):
+    """
+    Model for the cooldowns table
+    This table holds the token buckets for command cooldowns so they survive restarts
+    and are shared between every bot process using the same database
+
+    Args:
+        Base (Base): Declared base from SQLAlchemy
+        key (String): Primary key for the table, the command and user the bucket belongs to
+        tokens (Float): Tokens left in the bucket when it was last updated
+        updated_at (Float): Unix time the bucket was last updated
+        expires_at (Float): Unix time the bucket is full again and can be thrown away
+
+    Returns:
+        Cooldowns: SQLAlchemy model for the cooldowns table
+    """
+    __tablename__ = "cooldowns"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<Cooldowns(key={self.key}, tokens={self.tokens}, updated_at={self.updated_at}, expires_at={self.expires_at})>"
+
+
+class ArchivedPeriods(Base):
+    """
+    Model for the archived_periods table
+    This table lists the monthly archive tables old rolls and doublerolls have been moved into
+
+    Args:
+        Base (Base): Declared base from SQLAlchemy
+        table_name (String): Primary key for the table, name of the archive table
+        source (String): The table the rows were moved out of, rolls or doublerolls
+        year (Integer): Year of the archived month
+        month (Integer): Month that was archived (1-12)
+        row_count (Integer): Number of rows in the archive table
+        archived_at (DateTime): The last time rows were moved into the archive table
+
+    Returns:
+        ArchivedPeriods: SQLAlchemy model for the archived_periods table
+    """
+    __tablename__ = "archived_periods"
+    table_name = Column(String, primary_key=True)
+    source = Column(String, nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    row_count = Column(Integer, default=0, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"<ArchivedPeriods(table_name={self.table_name}, source={self.source}, year={self.year}, month={self.month}, row_count={self.row_count})>"
+
+
+class VoidBatches(Base):
+    """
+    Model for the void_batches table
+    This table records every /pitvoid so it can be undone on its own
+
+    Args:
+        Base (Base): Declared base from SQLAlchemy
+        batch_id (Integer): Primary key for the table
+        removed_by (BigInteger): Foreign key to the users table denoting who voided the rolls
+        voided_at (DateTime): The time the rolls were voided
+        filters (String): Description of the filters that picked the rolls
+        roll_count (Integer): Number of rolls voided
+        restored_at (DateTime): The time the batch was undone, None if it hasn't been
+
+    Returns:
+        VoidBatches: SQLAlchemy model for the void_batches table
+    """
+    __tablename__ = "void_batches"
+    batch_id = Column(Integer, primary_key=True)
+    removed_by = Column(BigInteger, ForeignKey('users.userid'), nullable=False, index=True)
+    voided_at = Column(DateTime, default=datetime.now)
+    filters = Column(String, nullable=False)
+    roll_count = Column(Integer, default=0, nullable=False)
+    restored_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<VoidBatches(batch_id={self.batch_id}, removed_by={self.removed_by}, voided_at={self.voided_at}, roll_count={self.roll_count}, restored_at={self.restored_at})>"
+
+
+class VoidedRolls(Base):
+    """
+    Model for the voided_rolls table
+    This table holds the rolls each void batch removed. Roll IDs are kept when rolls are archived,
+    so a batch can be undone wherever its rolls ended up
+
+    Args:
+        Base (Base): Declared base from SQLAlchemy
+        batch_id (Integer): Foreign key to the void_batches table
+        roll_id (Integer): ID of the voided roll
+
+    Returns:
+        VoidedRolls: SQLAlchemy model for the voided_rolls table
+    """
+    __tablename__ = "voided_rolls"
+    batch_id = Column(Integer, ForeignKey('void_batches.batch_id'), primary_key=True)
+    roll_id = Column(Integer, primary_key=True)
+
+    def __repr__(self):
+        return f"<VoidedRolls(batch_id={self.batch_id}, roll_id={self.roll_id})>"
+
+
+def archive_table_name(source: str, year: int, month: int) -> str:
+    """
+    Gets the name of the archive table for a month
+
+    Args:
+        source (str): The table the rows come from, rolls or doublerolls
+        year (int): Year of the month
+        month (int): Month (1-12)
+
+    Returns:
+        str: Name of the archive table
+    """
+    return f"{source}_{year}_{month:02d}"
+
+
+def rolls_archive_table(year: int, month: int) -> Table:
+    """
+    Gets the archive table for a month of rolls. Has the same columns as the rolls table
+
+    Args:
+        year (int): Year of the month
+        month (int): Month (1-12)
+
+    Returns:
+        Table: The archive table
+    """
+    name = archive_table_name("rolls", year, month)
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    return Table(
+        name,
+        archive_metadata,
+        Column("roll_id", Integer, primary_key=True),
+        Column("user_id", BigInteger, nullable=False, index=True),
+        Column("roll", Integer, nullable=False),
+        Column("timestamp", DateTime),
+        Column("roll_removed", Boolean, default=False),
+        Column("removed_by", BigInteger),
+    )
+
+
+def doublerolls_archive_table(year: int, month: int) -> Table:
+    """
+    Gets the archive table for a month of doublerolls. Has the same columns as the doublerolls table
+
+    Args:
+        year (int): Year of the month
+        month (int): Month (1-12)
+
+    Returns:
+        Table: The archive table
+    """
+    name = archive_table_name("doublerolls", year, month)
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    return Table(
+        name,
+        archive_metadata,
+        Column("doubleroll_id", Integer, primary_key=True),
+        Column("user_id", BigInteger, nullable=False, index=True),
+        Column("timestamp", DateTime),
+    )
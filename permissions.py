@@ -0,0 +1,159 @@
+import enum
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple, Union
+
+import discord
+
+
+class Capability(enum.IntFlag):
+    """
+    Everything a gated command can ask for. Stored as a bitset per member
+    """
+
+    NONE = 0
+    SUBSCRIBER = 1
+    MOD = 2
+    DATA = 4
+    DEBUG = 8
+
+
+def build_capabilities(grants: Iterable[tuple]) -> Dict[int, Capability]:
+    """
+    Builds an id to capability mapping, merging ids that show up more than once
+
+    Args:
+        grants (Iterable[tuple]): (ids, capability) pairs
+
+    Returns:
+        Dict[int, Capability]: Capabilities for each id
+    """
+    mapping: Dict[int, Capability] = {}
+    for ids, capability in grants:
+        for object_id in ids:
+            mapping[object_id] = mapping.get(object_id, Capability.NONE) | capability
+    return mapping
+
+
+class PermissionIndex:
+    """
+    Caches the capability bitset of each member so gated commands don't walk the member's roles on every call.
+    Entries are worked out the first time a member is seen and refreshed from member and role events.
+    The role IDs an entry was worked out from are kept with it, so refreshing a member whose roles
+    haven't changed is just a set comparison
+
+    Args:
+        role_capabilities (Dict[int, Capability]): Capabilities granted by each role ID
+        user_capabilities (Dict[int, Capability]): Capabilities granted to specific user IDs wherever they are
+    """
+
+    def __init__(
+        self,
+        role_capabilities: Dict[int, Capability],
+        user_capabilities: Dict[int, Capability],
+    ):
+        self.role_capabilities = role_capabilities
+        self.user_capabilities = user_capabilities
+        # guild id (None for DMs): {user id: (role ids, capabilities)}
+        self._index: Dict[Optional[int], Dict[int, Tuple[FrozenSet[int], Capability]]] = {}
+
+    def compute(self, user: Union[discord.Member, discord.User]) -> Capability:
+        """
+        Works out the capabilities of a user from scratch
+
+        Args:
+            user (Union[discord.Member, discord.User]): The user to check, roles only count for members
+
+        Returns:
+            Capability: Everything the user is allowed to do
+        """
+        return self._compute(user.id, _role_ids(user))
+
+    def _compute(self, user_id: int, role_ids: FrozenSet[int]) -> Capability:
+        capabilities = self.user_capabilities.get(user_id, Capability.NONE)
+        for role_id in role_ids:
+            capabilities |= self.role_capabilities.get(role_id, Capability.NONE)
+        return capabilities
+
+    def capabilities(self, user: Union[discord.Member, discord.User]) -> Capability:
+        """
+        Gets the capabilities of a user, working them out if they aren't indexed yet
+
+        Args:
+            user (Union[discord.Member, discord.User]): The user to check
+
+        Returns:
+            Capability: Everything the user is allowed to do
+        """
+        members = self._index.setdefault(_guild_id(user), {})
+        entry = members.get(user.id)
+        if entry is None:
+            role_ids = _role_ids(user)
+            entry = members[user.id] = (role_ids, self._compute(user.id, role_ids))
+        return entry[1]
+
+    def allowed(self, user: Union[discord.Member, discord.User], capability: Capability) -> bool:
+        """
+        Checks if a user has any of the given capabilities
+
+        Args:
+            user (Union[discord.Member, discord.User]): The user to check
+            capability (Capability): One or more capabilities, any of them is enough
+
+        Returns:
+            bool: If the user is allowed
+        """
+        return bool(self.capabilities(user) & capability)
+
+    def update_member(self, member: discord.Member) -> None:
+        """
+        Recomputes the capabilities of a member if their roles are different from the ones they were indexed with
+
+        Args:
+            member (discord.Member): The member to refresh
+        """
+        members = self._index.setdefault(_guild_id(member), {})
+        role_ids = _role_ids(member)
+        entry = members.get(member.id)
+        if entry is None or entry[0] != role_ids:
+            members[member.id] = (role_ids, self._compute(member.id, role_ids))
+
+    def forget_member(self, guild_id: Optional[int], user_id: int) -> None:
+        """
+        Drops a member from the index
+
+        Args:
+            guild_id (Optional[int]): Guild the member was in, None for DMs
+            user_id (int): Discord User ID
+        """
+        self._index.get(guild_id, {}).pop(user_id, None)
+
+    def forget_guild(self, guild_id: Optional[int]) -> None:
+        """
+        Drops every member of a guild from the index, they get worked out again on their next command
+
+        Args:
+            guild_id (Optional[int]): The guild to drop
+        """
+        self._index.pop(guild_id, None)
+
+    def update_role(self, role: discord.Role) -> None:
+        """
+        Handles a role being changed or deleted. Only roles that grant something can change a member's capabilities
+
+        Args:
+            role (discord.Role): The role that changed
+        """
+        if role.id in self.role_capabilities:
+            self.forget_guild(role.guild.id)
+
+
+def _guild_id(user: Union[discord.Member, discord.User]) -> Optional[int]:
+    guild = getattr(user, "guild", None)
+    return guild.id if guild else None
+
+
+def _role_ids(user: Union[discord.Member, discord.User]) -> FrozenSet[int]:
+    # Member.roles looks up, and sorts, a Role for every ID. The raw IDs are all the index needs
+    role_ids = getattr(user, "_roles", None)
+    if role_ids is None:
+        role_ids = [role.id for role in getattr(user, "roles", ())]
+    return frozenset(role_ids)
@@ -0,0 +1,176 @@
+import datetime
+import json
+import os
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+# fixed width column files, one value per roll, ordered by roll_id
+COLUMNS: Dict[str, str] = {
+    "roll_id": "<i8",
+    "user_id": "<i8",
+    "roll": "u1",
+    "timestamp": "<i8",  # microseconds since 1970-01-01, same naive local time as the database
+    "removed": "u1",
+}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_micros(timestamp: datetime.datetime) -> int:
+    """
+    Converts a naive database timestamp to microseconds since the epoch without applying any timezone
+
+    Args:
+        timestamp (datetime.datetime): The timestamp to convert
+
+    Returns:
+        int: Microseconds since 1970-01-01
+    """
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+class RollSnapshot:
+    """
+    Columnar copy of the roll history kept in memory-mapped files so analytics never touch the live database.
+    Rolls are only ever appended past the high water mark, the removed flags are the only thing rewritten
+
+    Args:
+        path (str): Directory holding the snapshot files
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.high_water_mark = 0
+        self._columns: Dict[str, np.ndarray] = {}
+        os.makedirs(path, exist_ok=True)
+        self._load_meta()
+        self._map()
+
+    @property
+    def roll_id(self) -> np.ndarray:
+        return self._columns["roll_id"]
+
+    @property
+    def user_id(self) -> np.ndarray:
+        return self._columns["user_id"]
+
+    @property
+    def roll(self) -> np.ndarray:
+        return self._columns["roll"]
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        return self._columns["timestamp"]
+
+    @property
+    def removed(self) -> np.ndarray:
+        return self._columns["removed"]
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    def _load_meta(self) -> None:
+        try:
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        if meta.get("version") != SNAPSHOT_VERSION:
+            # older layout, start again from nothing
+            return
+        self.rows = meta["rows"]
+        self.high_water_mark = meta["high_water_mark"]
+
+    def _save_meta(self) -> None:
+        # written after the column data and swapped in atomically, so a crash never points past the data
+        tmp_path = self._meta_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "rows": self.rows,
+                    "high_water_mark": self.high_water_mark,
+                },
+                f,
+            )
+        os.replace(tmp_path, self._meta_path())
+
+    def _map(self) -> None:
+        self._columns = {}
+        for name, dtype in COLUMNS.items():
+            if self.rows:
+                self._columns[name] = np.memmap(
+                    self._column_path(name), dtype=dtype, mode="r", shape=(self.rows,)
+                )
+            else:
+                self._columns[name] = np.empty(0, dtype=dtype)
+
+    def append(self, rolls: Iterable[Tuple[int, int, int, datetime.datetime, bool]]) -> int:
+        """
+        Appends rolls past the high water mark to the end of every column
+
+        Args:
+            rolls (Iterable[Tuple[int, int, int, datetime.datetime, bool]]): (roll_id, user_id, roll, timestamp, removed)
+            rows ordered by roll_id
+
+        Returns:
+            int: Number of rolls appended
+        """
+        rolls = [roll for roll in rolls if roll[0] > self.high_water_mark]
+        if not rolls:
+            return 0
+        values = {
+            "roll_id": [roll[0] for roll in rolls],
+            "user_id": [roll[1] for roll in rolls],
+            "roll": [roll[2] for roll in rolls],
+            "timestamp": [to_micros(roll[3]) for roll in rolls],
+            "removed": [bool(roll[4]) for roll in rolls],
+        }
+        self._columns = {}  # let go of the old maps before the files change
+        for name, dtype in COLUMNS.items():
+            itemsize = np.dtype(dtype).itemsize
+            with open(self._column_path(name), "ab") as f:
+                # drop anything a crashed append left past the last saved row
+                f.truncate(self.rows * itemsize)
+                f.write(np.asarray(values[name], dtype=dtype).tobytes())
+        self.rows += len(rolls)
+        self.high_water_mark = rolls[-1][0]
+        self._save_meta()
+        self._map()
+        return len(rolls)
+
+    def sync_removed(self, removed_roll_ids: Iterable[int]) -> int:
+        """
+        Rewrites the removed column so exactly the given rolls are flagged
+
+        Args:
+            removed_roll_ids (Iterable[int]): roll_id of every removed roll
+
+        Returns:
+            int: Number of rolls whose flag changed
+        """
+        if not self.rows:
+            return 0
+        removed_ids = np.fromiter(removed_roll_ids, dtype="<i8")
+        flags = np.zeros(self.rows, dtype="u1")
+        positions = np.searchsorted(self.roll_id, removed_ids)
+        found = positions < self.rows
+        found[found] = self.roll_id[positions[found]] == removed_ids[found]
+        flags[positions[found]] = 1
+
+        changed = int(np.count_nonzero(flags != self.removed))
+        if changed:
+            self._columns["removed"] = np.empty(0, dtype="u1")
+            column = np.memmap(self._column_path("removed"), dtype="u1", mode="r+", shape=(self.rows,))
+            column[:] = flags
+            column.flush()
+            del column
+            self._map()
+        return changed
@@ -0,0 +1,83 @@
+import contextlib
+import logging
+import time
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Times the named phases of starting the bot. Phases are recorded in the order they finish
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.failed: List[str] = []
+        self._started: Dict[str, float] = {}
+        self._created = time.perf_counter()
+
+    def begin(self, name: str) -> None:
+        """
+        Starts timing a phase that ends somewhere else, like in an event handler
+
+        Args:
+            name (str): Name of the phase
+        """
+        self._started[name] = time.perf_counter()
+
+    def end(self, name: str, failed: bool = False) -> Optional[float]:
+        """
+        Stops timing a phase started with begin. Does nothing if the phase isn't running
+
+        Args:
+            name (str): Name of the phase
+            failed (bool): If the phase blew up
+
+        Returns:
+            Optional[float]: Seconds the phase took, None if it wasn't running
+        """
+        started = self._started.pop(name, None)
+        if started is None:
+            return None
+        duration = self.durations[name] = time.perf_counter() - started
+        if failed:
+            self.failed.append(name)
+            logger.error("Startup phase %s failed after %.3f seconds", name, duration)
+        else:
+            logger.info("Startup phase %s took %.3f seconds", name, duration)
+        return duration
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Times everything inside the with block as one phase, works around awaits too
+
+        Args:
+            name (str): Name of the phase
+        """
+        self.begin(name)
+        try:
+            yield
+        except BaseException:
+            self.end(name, failed=True)
+            raise
+        self.end(name)
+
+    @property
+    def total(self) -> float:
+        """Seconds since the timer was made"""
+        return time.perf_counter() - self._created
+
+    def report(self) -> str:
+        """
+        Describes how long each phase took
+
+        Returns:
+            str: One line with every finished phase and the total
+        """
+        phases = ", ".join(
+            f"{name} {duration:.3f}s{' (failed)' if name in self.failed else ''}"
+            for name, duration in self.durations.items()
+        )
+        return f"{phases or 'no phases'}, {self.total:.3f}s total"
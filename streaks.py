@@ -0,0 +1,81 @@
+import datetime
+from typing import Iterable, Tuple
+
+# rolls at or above this count towards a high streak
+HIGH_ROLL = 7
+# rolls at or below this count towards a low streak
+LOW_ROLL = 5
+
+
+def reset_streak(streak) -> None:
+    """
+    Resets every counter on a streak row back to nothing
+
+    Args:
+        streak (Streaks): The streak row to reset
+    """
+    streak.last_roll_date = None
+    streak.current_days = 0
+    streak.best_days = 0
+    streak.current_high = 0
+    streak.best_high = 0
+    streak.current_low = 0
+    streak.best_low = 0
+
+
+def advance_streak(streak, roll: int, roll_date: datetime.date) -> None:
+    """
+    Applies a single roll to a streak row in place.
+    Only looks at the previous state so every roll is a constant time update
+
+    Args:
+        streak (Streaks): The streak row to update
+        roll (int): The roll they rolled (1-12)
+        roll_date (datetime.date): Date the roll was made
+    """
+    last = streak.last_roll_date
+    if last is None or last < roll_date - datetime.timedelta(days=1):
+        streak.current_days = 1
+    elif last == roll_date - datetime.timedelta(days=1):
+        streak.current_days = (streak.current_days or 0) + 1
+    # a second roll on the same day doesn't extend the day streak
+    streak.last_roll_date = max(last, roll_date) if last else roll_date
+
+    streak.current_high = (streak.current_high or 0) + 1 if roll >= HIGH_ROLL else 0
+    streak.current_low = (streak.current_low or 0) + 1 if roll <= LOW_ROLL else 0
+
+    streak.best_days = max(streak.best_days or 0, streak.current_days)
+    streak.best_high = max(streak.best_high or 0, streak.current_high)
+    streak.best_low = max(streak.best_low or 0, streak.current_low)
+
+
+def replay_streak(streak, rolls: Iterable[Tuple[int, datetime.datetime]]) -> None:
+    """
+    Rebuilds a streak row from scratch using a user's roll history
+
+    Args:
+        streak (Streaks): The streak row to rebuild
+        rolls (Iterable[Tuple[int, datetime.datetime]]): (roll, timestamp) pairs, oldest first
+    """
+    reset_streak(streak)
+    for roll, timestamp in rolls:
+        advance_streak(streak, roll, timestamp.date())
+
+
+def live_day_streak(streak, today: datetime.date) -> int:
+    """
+    Gets the day streak as it stands today.
+    A streak is still alive if the user rolled today or yesterday
+
+    Args:
+        streak (Streaks): The streak row to check
+        today (datetime.date): Today's date
+
+    Returns:
+        int: Number of consecutive days rolled, 0 if the streak has been broken
+    """
+    if streak.last_roll_date is None:
+        return 0
+    if streak.last_roll_date < today - datetime.timedelta(days=1):
+        return 0
+    return streak.current_days
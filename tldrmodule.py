@@ -1,12 +1,252 @@
 from textsum.summarize import Summarizer
+import textsum.summarize
 import asyncio
+import logging
+import math
+import os
+import re
+import contextlib
 from functools import wraps, partial
+from typing import List, NamedTuple
+import torch
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer
 
 model = "philschmid/bart-large-cnn-samsum"
 
-# load summarizer
-summarizer = Summarizer(model_name_or_path=model,
-                        token_batch_length=1024, use_cuda=False, max_length=100)
+# directory holding the memory-mapped copy of the weights shared by every worker on the host
+shared_weights_dir = os.environ.get("SUMMARIZER_WEIGHTS", "data/summarizer")
+SHARED_WEIGHTS_FILE = "weights.pt"
+
+summarizer_kwargs = dict(token_batch_length=1024, use_cuda=False, max_length=100)
+
+logger = logging.getLogger(__name__)
+
+# a transcript line that starts a new message, "display_name : content"
+UTTERANCE_START = re.compile(r"^.+? : ")
+
+_summarizer = None
+
+
+def export_shared_weights(path: str = shared_weights_dir):
+    """
+    Writes the model weights, config and tokenizer to a directory so workers can map them instead of loading them.
+    Only needs to run once per host
+
+    parameters:
+    path: str
+        Directory to write to
+    """
+    os.makedirs(path, exist_ok=True)
+    full_model = AutoModelForSeq2SeqLM.from_pretrained(model)
+    full_model.config.save_pretrained(path)
+    AutoTokenizer.from_pretrained(model).save_pretrained(path)
+    # write to a temp file first so a worker never maps a half written file
+    tmp_path = os.path.join(path, SHARED_WEIGHTS_FILE + ".tmp")
+    torch.save(full_model.state_dict(), tmp_path)
+    os.replace(tmp_path, os.path.join(path, SHARED_WEIGHTS_FILE))
+
+
+def load_shared_model(path: str = shared_weights_dir):
+    """
+    Builds the model around weights memory-mapped read only from the shared file.
+    Every worker mapping the same file shares the same physical pages, so a worker only costs its activations
+
+    parameters:
+    path: str
+        Directory written by export_shared_weights
+    returns:
+    shared_model: PreTrainedModel
+        The model in eval mode
+    """
+    config = AutoConfig.from_pretrained(path)
+    # build the model without allocating any weights, they come from the mapped file
+    with torch.device("meta"):
+        shared_model = AutoModelForSeq2SeqLM.from_config(config)
+    state_dict = torch.load(
+        os.path.join(path, SHARED_WEIGHTS_FILE), mmap=True, weights_only=True, map_location="cpu"
+    )
+    shared_model.load_state_dict(state_dict, strict=False, assign=True)
+    shared_model.tie_weights()
+    missing = [name for name, tensor in shared_model.state_dict().items() if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"Shared weights in {path} are missing {missing}")
+    return shared_model.eval()
+
+
+@contextlib.contextmanager
+def _use_model(loaded_model):
+    # textsum can only load its model through AutoModelForSeq2SeqLM.from_pretrained, so hand it ours instead
+    class Loader:
+        @staticmethod
+        def from_pretrained(*args, **kwargs):
+            return loaded_model
+
+    original = textsum.summarize.AutoModelForSeq2SeqLM
+    textsum.summarize.AutoModelForSeq2SeqLM = Loader
+    try:
+        yield
+    finally:
+        textsum.summarize.AutoModelForSeq2SeqLM = original
+
+
+def get_summarizer() -> Summarizer:
+    """
+    Gets the summarizer, loading it the first time.
+    Uses the shared memory-mapped weights if they have been exported, otherwise loads a private copy
+
+    returns:
+    summarizer: Summarizer
+        The summarizer
+    """
+    global _summarizer
+    if _summarizer is None:
+        if os.path.exists(os.path.join(shared_weights_dir, SHARED_WEIGHTS_FILE)):
+            with _use_model(load_shared_model(shared_weights_dir)):
+                _summarizer = Summarizer(model_name_or_path=shared_weights_dir, **summarizer_kwargs)
+        else:
+            _summarizer = Summarizer(model_name_or_path=model, **summarizer_kwargs)
+    return _summarizer
+
+
+class Chunks(NamedTuple):
+    """
+    A transcript packed into model sized batches
+
+    batches: List[str]
+        Text of each batch, made of whole messages where possible
+    tokens: List[int]
+        Number of tokens in each batch
+    batch_length: int
+        Token budget of a batch
+    """
+
+    batches: List[str]
+    tokens: List[int]
+    batch_length: int
+
+    @property
+    def efficiency(self) -> float:
+        """Share of the batches that is real input rather than padding"""
+        if not self.batches:
+            return 1.0
+        return sum(self.tokens) / (len(self.batches) * self.batch_length)
+
+
+def split_utterances(text: str) -> List[str]:
+    """
+    Splits a transcript into messages, keeping multi-line messages together
+
+    parameters:
+    text: str
+        Transcript of "display_name : content" lines
+    returns:
+    utterances: List[str]
+        One string per message
+    """
+    utterances: List[str] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if utterances and not UTTERANCE_START.match(line):
+            utterances[-1] += "\n" + line
+        else:
+            utterances.append(line.rstrip())
+    return utterances
+
+
+def _pack(costs: List[int], budget: int, target: int) -> List[List[int]]:
+    # greedy packing of item indexes, a batch is closed at whichever side of target is closer and never goes over budget
+    batches: List[List[int]] = []
+    current: List[int] = []
+    size = 0
+    for index, cost in enumerate(costs):
+        overshoot = size + cost - target
+        if current and (size + cost > budget or overshoot > target - size):
+            batches.append(current)
+            current, size = [], 0
+        current.append(index)
+        size += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def chunk_utterances(
+    costs: List[int],
+    batch_length: int,
+    min_tail: float = 0.25,
+) -> List[List[int]]:
+    """
+    Packs whole messages into batches as close to the token budget as possible,
+    evening the batches out so the last one isn't mostly padding
+
+    parameters:
+    costs: List[int]
+        Number of tokens each message takes up in a batch, none of them more than batch_length
+    batch_length: int
+        Token budget of a batch
+    min_tail: float
+        Last batches smaller than this share of batch_length are merged into the one before if they fit
+    returns:
+    batches: List[List[int]]
+        Indexes of the messages in each batch
+    """
+    greedy = _pack(costs, batch_length, batch_length)
+    batches = greedy
+    if len(greedy) > 1:
+        # same number of batches, but spread the messages evenly between them
+        balanced = _pack(costs, batch_length, math.ceil(sum(costs) / len(greedy)))
+        if len(balanced) <= len(greedy):
+            batches = balanced
+    if len(batches) > 1:
+        tail = sum(costs[index] for index in batches[-1])
+        previous = sum(costs[index] for index in batches[-2])
+        if tail < batch_length * min_tail and previous + tail <= batch_length:
+            batches[-2].extend(batches.pop())
+    return batches
+
+
+def chunk_transcript(text: str, tokenizer, batch_length: int) -> Chunks:
+    """
+    Splits a transcript into batches of whole messages for the summarizer
+
+    parameters:
+    text: str
+        Transcript of "display_name : content" lines
+    tokenizer: PreTrainedTokenizer
+        The summarizer's tokenizer
+    batch_length: int
+        Most tokens the model takes in one go, including special tokens
+    returns:
+    chunks: Chunks
+        The batches and how full they are
+    """
+    budget = batch_length - tokenizer.num_special_tokens_to_add()
+    separator_cost = len(tokenizer("\n", add_special_tokens=False).input_ids)
+
+    utterances: List[str] = []
+    costs: List[int] = []
+    messages = split_utterances(text)
+    token_ids = tokenizer(messages, add_special_tokens=False).input_ids if messages else []
+    for message, ids in zip(messages, token_ids):
+        if len(ids) + separator_cost <= budget:
+            utterances.append(message)
+            costs.append(len(ids) + separator_cost)
+            continue
+        # a single message longer than a batch has to be cut up
+        step = budget - separator_cost
+        for start in range(0, len(ids), step):
+            piece = ids[start : start + step]
+            utterances.append(tokenizer.decode(piece))
+            costs.append(len(piece) + separator_cost)
+
+    batches = chunk_utterances(costs, budget)
+    return Chunks(
+        batches=["\n".join(utterances[index] for index in batch) for batch in batches],
+        tokens=[sum(costs[index] for index in batch) for batch in batches],
+        batch_length=budget,
+    )
+
 
 def wrap(func):
     @wraps(func)
@@ -32,9 +272,32 @@ def generate_summ(messages_to_summ: str):
     # Due to stupid design choices, we need to write our own wrapper for the summarizer
     # Calling summarize_string directly will output the string with tabs which we don't want
     # so easier to just write our own wrapper
-    gen_summaries = summarizer.summarize_via_tokenbatches(
-            messages_to_summ,
-            batch_length=None, batch_stride=None) # type: ignore # function I call defaults to None so fuck it we ball
-    sum_text = [s["summary"][0] for s in gen_summaries]
+    summarizer = get_summarizer()
+    chunks = chunk_transcript(
+        messages_to_summ, summarizer.tokenizer, summarizer.token_batch_length
+    )
+    logger.info(
+        "Summarizing %s tokens in %s batches, %.1f%% full",
+        sum(chunks.tokens),
+        len(chunks.batches),
+        chunks.efficiency * 100,
+    )
+    params = summarizer.get_inference_params()
+    sum_text = []
+    for batch in chunks.batches:
+        # batches are sized to fit, but a cut up message can re-tokenize a little longer than it was counted
+        # (a character split between pieces), so truncate rather than overflow the position embeddings
+        encoded = summarizer.tokenizer(
+            batch, return_tensors="pt", truncation=True, max_length=summarizer.token_batch_length
+        )
+        summary, _ = summarizer.summarize_and_score(
+            ids=encoded.input_ids[0], mask=encoded.attention_mask[0], **params
+        )
+        sum_text.append(summary[0])
     full_summary = "\n".join(sum_text)
-    return full_summary
\ No newline at end of file
+    return full_summary
+
+if __name__ == "__main__":
+    # python tldrmodule.py exports the shared weights for this host
+    export_shared_weights()
+    print(f"Exported shared weights to {shared_weights_dir}")
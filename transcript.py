@@ -0,0 +1,223 @@
+import re
+from collections import deque
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Tuple
+
+CUSTOM_EMOTE = re.compile(r"<a?:\w+:\d+>")
+LINK = re.compile(r"https?://\S+")
+WHITESPACE = re.compile(r"\s+")
+
+# one word messages that never add anything to a summary
+DEFAULT_REACTIONS = frozenset(
+    [
+        "lol", "lmao", "lmfao", "kek", "kekw", "omegalul", "xd", "haha", "hahaha", "rofl",
+        "w", "l", "true", "real", "based", "same", "yes", "no", "yeah", "nah", "ok", "okay",
+        "k", "ye", "yep", "nope", "f", "gg", "wtf", "bruh", "damn", "nice", "rip", "oof",
+    ]
+)
+
+
+class FilterRules(NamedTuple):
+    """
+    What to drop or tidy up before a transcript goes to the summarizer
+
+    Args:
+        drop_empty (bool): Drop messages with no text, like attachment only ones
+        drop_emote_only (bool): Drop messages that are only emotes or emoji
+        drop_link_only (bool): Drop messages that are only links
+        drop_reactions (bool): Drop one word reactions like "lol"
+        reactions (FrozenSet[str]): Words counted as reactions, lowercase
+        max_reaction_length (int): Any other one word message this short counts as a reaction too, 0 to only use reactions
+        collapse_repeats (bool): Merge back to back identical messages from the same person into one line
+        dedupe_window (int): Drop a message if the same text was kept in the last this many messages, 0 to turn off
+        strip_emotes (bool): Take custom emotes out of the messages that are kept
+        strip_links (bool): Replace links in the messages that are kept with <link>
+    """
+
+    drop_empty: bool = True
+    drop_emote_only: bool = True
+    drop_link_only: bool = True
+    drop_reactions: bool = True
+    reactions: FrozenSet[str] = DEFAULT_REACTIONS
+    # short words like "why" or "100" are real answers, so only the listed reactions are dropped by default
+    max_reaction_length: int = 0
+    collapse_repeats: bool = True
+    dedupe_window: int = 50
+    strip_emotes: bool = True
+    strip_links: bool = True
+
+
+# keeps every message as is, for when you want to see what the summarizer would have got before filtering
+NO_FILTER = FilterRules(
+    drop_empty=False,
+    drop_emote_only=False,
+    drop_link_only=False,
+    drop_reactions=False,
+    collapse_repeats=False,
+    dedupe_window=0,
+    strip_emotes=False,
+    strip_links=False,
+)
+
+
+class FilterReport(NamedTuple):
+    """
+    How much a transcript shrank
+
+    Args:
+        messages_in (int): Messages before filtering
+        messages_out (int): Lines left in the transcript
+        dropped (Dict[str, int]): Number of messages dropped for each reason
+        tokens_in (int): Estimated tokens before filtering
+        tokens_out (int): Estimated tokens after filtering
+    """
+
+    messages_in: int
+    messages_out: int
+    dropped: Dict[str, int]
+    tokens_in: int
+    tokens_out: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def __str__(self) -> str:
+        reasons = ", ".join(f"{count} {reason}" for reason, count in self.dropped.items() if count)
+        saved = 100 * self.tokens_saved / self.tokens_in if self.tokens_in else 0
+        return (
+            f"{self.messages_in} messages down to {self.messages_out} lines ({reasons or 'nothing dropped'}), "
+            f"~{self.tokens_in} tokens down to ~{self.tokens_out} ({saved:.0f}% saved)"
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for English chat, about 4 characters a token
+
+    Args:
+        text (str): The text to count
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    return (len(text) + 3) // 4
+
+
+def format_line(display_name: str, content: str) -> str:
+    """
+    Formats a message the way the summarizer expects it
+
+    Args:
+        display_name (str): Who sent the message
+        content (str): What they said
+
+    Returns:
+        str: The transcript line
+    """
+    return f"{display_name} : {content} \n"
+
+
+def clean_content(content: str, rules: FilterRules) -> Tuple[str, str]:
+    """
+    Tidies up a message and works out if it's worth keeping
+
+    Args:
+        content (str): The message text
+        rules (FilterRules): What to drop or tidy up
+
+    Returns:
+        Tuple[str, str]: The cleaned text, and the reason to drop it or an empty string to keep it
+    """
+    without_links = LINK.sub(" ", content)
+    without_emotes = CUSTOM_EMOTE.sub(" ", without_links)
+    words = without_emotes.split()
+
+    if not content.strip():
+        return ("", "empty") if rules.drop_empty else ("", "")
+    if rules.drop_link_only and LINK.search(content) and not CUSTOM_EMOTE.sub("", without_links).strip():
+        return "", "links"
+    # links still count as content here, whether they are dropped is up to drop_link_only
+    if rules.drop_emote_only and not any(character.isalnum() for character in CUSTOM_EMOTE.sub(" ", content)):
+        return "", "emotes"
+    if rules.drop_reactions and len(words) == 1:
+        word = words[0].strip(".!?,~").lower()
+        if word in rules.reactions or len(word) <= rules.max_reaction_length:
+            return "", "reactions"
+
+    cleaned = content
+    if rules.strip_links:
+        cleaned = LINK.sub("<link>", cleaned)
+    if rules.strip_emotes:
+        cleaned = CUSTOM_EMOTE.sub("", cleaned)
+    return WHITESPACE.sub(" ", cleaned).strip(), ""
+
+
+def build_transcript(
+    messages: Iterable,
+    bots: Iterable[int],
+    rules: FilterRules = FilterRules(),
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> Tuple[str, FilterReport]:
+    """
+    Turns chat messages into a transcript for the summarizer, dropping anything that doesn't carry information
+
+    Args:
+        messages (Iterable[discord.Message]): The messages, oldest first
+        bots (Iterable[int]): User IDs of bots to leave out
+        rules (FilterRules): What to drop or tidy up
+        count_tokens (Callable[[str], int]): Counts the tokens in a piece of text
+
+    Returns:
+        Tuple[str, FilterReport]: The transcript and how much it shrank
+    """
+    bots = set(bots)
+    dropped = {"bots": 0, "empty": 0, "links": 0, "emotes": 0, "reactions": 0, "repeats": 0, "duplicates": 0}
+    # [display_name, content, times in a row]
+    kept: List[list] = []
+    recent: deque = deque(maxlen=rules.dedupe_window or None)
+    recent_counts: Dict[str, int] = {}
+    messages_in = 0
+    tokens_in = 0
+
+    for message in messages:
+        messages_in += 1
+        if message.author.id in bots:
+            dropped["bots"] += 1
+            continue
+        tokens_in += count_tokens(format_line(message.author.display_name, message.content))
+
+        content, reason = clean_content(message.content, rules)
+        if reason:
+            dropped[reason] += 1
+            continue
+
+        key = content.lower()
+        if rules.collapse_repeats and kept and kept[-1][0] == message.author.display_name and kept[-1][1].lower() == key:
+            kept[-1][2] += 1
+            dropped["repeats"] += 1
+            continue
+        if rules.dedupe_window and recent_counts.get(key):
+            dropped["duplicates"] += 1
+            continue
+
+        kept.append([message.author.display_name, content, 1])
+        if rules.dedupe_window:
+            if len(recent) == recent.maxlen:
+                oldest = recent[0]
+                recent_counts[oldest] -= 1
+            recent.append(key)
+            recent_counts[key] = recent_counts.get(key, 0) + 1
+
+    lines = [
+        format_line(display_name, content if times == 1 else f"{content} (x{times})")
+        for display_name, content, times in kept
+    ]
+    text = "".join(lines)
+    report = FilterReport(
+        messages_in=messages_in,
+        messages_out=len(lines),
+        dropped=dropped,
+        tokens_in=tokens_in,
+        tokens_out=sum(count_tokens(line) for line in lines),
+    )
+    return text, report